@@ -0,0 +1,106 @@
+from datetime import datetime
+from airflow import DAG
+from airflow.decorators import task
+import os,gzip,itertools
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import xml.etree.ElementTree as ET
+import ingest_document as ingest
+
+BULK_MAX_URLS=int(os.environ.get('BULK_MAX_URLS','2000'))
+BULK_PER_HOST=int(os.environ.get('BULK_PER_HOST','2'))  # concurrent fetches against one host
+BULK_PARALLEL=int(os.environ.get('BULK_PARALLEL','16'))  # concurrent fetch tasks per run, across hosts
+SITEMAP_DEPTH=2
+
+def _local(tag):
+    return tag.rsplit('}',1)[-1]
+
+def sitemap_urls(url,depth=0):
+    """Page URLs listed in a sitemap (.xml or .xml.gz), following sitemap indexes up to SITEMAP_DEPTH."""
+    r=ingest._http.get(url,timeout=60); r.raise_for_status()
+    body=r.content
+    if body[:2]==b'\x1f\x8b': body=gzip.decompress(body)
+    root=ET.fromstring(body)
+    locs=[el.text.strip() for el in root.iter() if _local(el.tag)=='loc' and el.text and el.text.strip()]
+    if _local(root.tag)!='sitemapindex':
+        yield from locs; return
+    if depth<SITEMAP_DEPTH:
+        for sub in locs: yield from sitemap_urls(sub,depth+1)
+
+def shard_by_host(urls,per_host=None):
+    """Split urls into shards of a single host, at most `per_host` shards per host. Each shard is fetched
+    sequentially by one mapped task, so a host never sees more than `per_host` concurrent requests."""
+    per_host=max(1,per_host or BULK_PER_HOST)
+    hosts=OrderedDict()
+    for u in urls: hosts.setdefault(urlsplit(u).netloc.lower(),[]).append(u)
+    shards=[]
+    for host,us in hosts.items():
+        k=min(per_host,len(us))
+        shards.extend({'host':host,'urls':us[j::k]} for j in range(k))
+    return shards
+
+def ingest_shard(shard):
+    """Conditional GET, chunk and diff every url of a shard against Qdrant, feeding all changed chunks into one
+    embed/upsert pipeline; then delete stale points and save HTTP validators of the urls that completed.
+    Chunk text never leaves the task: the result is per-url counts (or the url's error) only."""
+    module,tags=shard['module'],shard['tags']
+    docs=[]
+    def items():
+        for url in shard['urls']:
+            d={'url':url,'chunks':0,'unchanged':0,'upserted':0,'deleted':0,'not_modified':False}
+            docs.append(d)
+            try:
+                have=ingest.existing_hashes(url)
+                validators=ingest.http_validators(url,have)
+                r,validators=ingest.open_stream(url,validators)
+                if r is None:
+                    d.update(chunks=len(have),unchanged=len(have),not_modified=True); continue
+                seen=set()
+                with r:
+                    for i,c in ingest.changed_chunks(r,url,module,tags,have,seen,d):
+                        d['upserted']+=1; yield url,i,c
+                d['_stale'],d['_validators']=sorted(set(have)-seen),validators
+            except Exception as e:
+                # chunks already queued for this url are still written (points are content-hashed); without
+                # saved validators or stale deletion the next run simply re-diffs it
+                d['error']=f'{type(e).__name__}: {e}'
+    # an embed/upsert failure is not per url: it fails the task, so Airflow retries the shard
+    ingest.upsert_points(items(),module,tags)
+    stale,done=[],[]
+    for d in docs:
+        ids,validators=d.pop('_stale',()),d.pop('_validators',None)
+        if 'error' in d: continue
+        stale+=ids; d['deleted']=len(ids)
+        if validators is not None: done.append((d['url'],validators))
+    if stale: ingest.delete_points(stale)
+    for url,validators in done: ingest.save_http_state(url,validators)
+    return docs
+
+@task
+def plan(**ctx):
+    conf=ctx['dag_run'].conf or {}
+    sitemaps=conf.get('sitemap') or []
+    if isinstance(sitemaps,str): sitemaps=[sitemaps]
+    found=itertools.chain(conf.get('urls') or [],*(sitemap_urls(s) for s in sitemaps))
+    urls=list(itertools.islice(OrderedDict.fromkeys(u.strip() for u in found if u and u.strip()),BULK_MAX_URLS))
+    if not urls: raise ValueError('no urls to ingest')
+    ingest.ensure_collection()
+    module=conf.get('module') or 'Unknown'; tags=conf.get('tags') or []
+    return [dict(s,module=module,tags=tags) for s in shard_by_host(urls,conf.get('per_host'))]
+
+@task(max_active_tis_per_dagrun=BULK_PARALLEL,retries=1)
+def fetch_chunk(shard):
+    return ingest_shard(shard)
+
+@task
+def merge(results):
+    docs=[d for shard in results for d in shard]
+    ok=[d for d in docs if 'error' not in d]
+    failed=[{'url':d['url'],'error':d['error']} for d in docs if 'error' in d]
+    if docs and not ok: raise RuntimeError(f'all {len(docs)} urls failed, first: {failed[0]}')
+    return {'urls':len(docs),'failed':failed,'not_modified':sum(d['not_modified'] for d in ok),
+            'chunks':sum(d['chunks'] for d in ok),'unchanged':sum(d['unchanged'] for d in ok),
+            'upserted':sum(d['upserted'] for d in docs),'deleted':sum(d['deleted'] for d in ok)}
+
+with DAG('ingest_bulk',start_date=datetime(2025,1,1),schedule_interval=None,catchup=False) as dag:
+    merge(fetch_chunk.expand(shard=plan()))
@@ -1,67 +1,337 @@
 from datetime import datetime
 from airflow import DAG
 from airflow.operators.python import PythonOperator
-import os,re,requests,hashlib
-from bs4 import BeautifulSoup
+import os,re,json,codecs,requests,hashlib,queue,tempfile,threading
+from html.parser import HTMLParser
+import numpy as np
+from orchestrator.embedder import embed_batch as hash_embed_batch  # mounted via PYTHONPATH, see docker-compose.yml
 
 OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY')
+OPENAI_EMBED_MODEL='text-embedding-3-small'
 QDRANT_URL=os.environ.get('QDRANT_URL','http://qdrant:6333')
 QCOL=os.environ.get('QDRANT_COLLECTION','wms_kb')
 EMB_DIM=int(os.environ.get('EMBED_DIM','1536'))
+EMBED_BATCH=int(os.environ.get('EMBED_BATCH','64'))
+UPSERT_PAGE=int(os.environ.get('UPSERT_PAGE','128'))
+PIPELINE_DEPTH=int(os.environ.get('INGEST_PIPELINE_DEPTH','2'))
+CHUNK_SIZE=int(os.environ.get('CHUNK_SIZE','1000'))
+CHUNK_OVERLAP=int(os.environ.get('CHUNK_OVERLAP','150'))
+MAX_CHUNKS=int(os.environ.get('INGEST_MAX_CHUNKS','0'))  # 0 = no cap
+STREAM_BYTES=64*1024
+PAYLOAD_VERSION=2  # 2: deterministic hash embedder + chunk text in the payload
+
+_http=requests.Session()
+_openai=None
+_ensured=set()
 
 def clean(t):
     return re.sub(r'\s+',' ',t).strip()
 
+class _HTMLText(HTMLParser):
+    # incremental HTML -> ('h'|'p', text) blocks; only the current block is ever buffered
+    SKIP={'script','style','noscript','template','svg'}
+    HEAD={'h1','h2','h3','h4','h5','h6'}
+    BLOCK={'p','div','section','article','main','header','footer','nav','aside','li','ul','ol','dl','dt','dd',
+           'tr','table','br','hr','pre','blockquote','figure','figcaption','form'}
+
+    def __init__(self,max_block):
+        super().__init__(convert_charrefs=True)
+        self.blocks=[]; self._buf=[]; self._len=0; self._skip=0; self._head=False; self._in_head=False; self._max=max_block
+
+    def handle_starttag(self,tag,attrs):
+        # <head> (title, meta) is skipped up to </head>, or up to <body> when the close tag is left out
+        if tag=='head': self._in_head=True
+        elif tag=='body': self._in_head=False
+        if tag in self.SKIP: self._skip+=1
+        elif tag in self.HEAD or tag in self.BLOCK: self._flush()
+        if tag in self.HEAD: self._head=True
+
+    def handle_endtag(self,tag):
+        if tag=='head': self._in_head=False
+        if tag in self.SKIP: self._skip=max(0,self._skip-1)
+        elif tag in self.HEAD: self._flush(); self._head=False
+        elif tag in self.BLOCK: self._flush()
+
+    def handle_data(self,d):
+        if self._skip or self._in_head: return
+        self._buf.append(d); self._len+=len(d)
+        if self._len>self._max: self._flush()
+
+    def _flush(self):
+        t=clean(''.join(self._buf)); self._buf=[]; self._len=0
+        if t: self.blocks.append(('h' if self._head else 'p',t))
+
+    def drain(self):
+        out,self.blocks=self.blocks,[]
+        return out
+
+def _decoder(r):
+    ctype=r.headers.get('content-type','')
+    enc=r.encoding if 'charset' in ctype.lower() and r.encoding else 'utf-8'
+    return codecs.getincrementaldecoder(enc)(errors='replace')
+
+def _html_blocks(r):
+    p=_HTMLText(4*CHUNK_SIZE); dec=_decoder(r)
+    for b in r.iter_content(STREAM_BYTES):
+        p.feed(dec.decode(b))
+        yield from p.drain()
+    p.feed(dec.decode(b'',final=True)); p.close(); p._flush()
+    yield from p.drain()
+
+def _text_blocks(parts):
+    # blank-line separated paragraphs; markdown '#' lines become headings
+    buf=''
+    for part in parts:
+        buf+=part
+        while True:
+            m=re.search(r'\n\s*\n',buf)
+            if m is None:
+                if len(buf)<=4*CHUNK_SIZE: break
+                cut=buf.rfind(' ',0,4*CHUNK_SIZE); cut=cut if cut>0 else 4*CHUNK_SIZE
+                para,buf=buf[:cut],buf[cut:]
+            else:
+                para,buf=buf[:m.start()],buf[m.end():]
+            yield from _para_blocks(para)
+    yield from _para_blocks(buf)
+
+def _para_blocks(para):
+    lines=[l for l in para.splitlines() if l.strip()]
+    body=[]
+    for l in lines:
+        if re.match(r'\s*#{1,6}\s',l):
+            if body: yield 'p',clean(' '.join(body)); body=[]
+            yield 'h',clean(l.lstrip().lstrip('#'))
+        else: body.append(l)
+    if body: yield 'p',clean(' '.join(body))
+
+def _pdf_blocks(r):
+    # pdfminer needs a seekable file: spool the body to disk, then walk it page by page
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+    with tempfile.TemporaryFile() as f:
+        for b in r.iter_content(STREAM_BYTES): f.write(b)
+        f.seek(0)
+        for page in extract_pages(f):
+            for el in page:
+                if isinstance(el,LTTextContainer):
+                    t=clean(el.get_text())
+                    if t: yield 'p',t
+
+def iter_blocks(r):
+    """Stream a response body as ('h'|'p', text) blocks without holding the whole document."""
+    ctype=r.headers.get('content-type','').lower()
+    if 'pdf' in ctype or r.url.lower().endswith('.pdf'): return _pdf_blocks(r)
+    if 'html' in ctype: return _html_blocks(r)
+    dec=_decoder(r)
+    return _text_blocks(dec.decode(b) for b in r.iter_content(STREAM_BYTES))
+
+_SENT_RE=re.compile(r'(?<=[.!?;:])\s+')
+
+def _sentences(text,size):
+    for sent in _SENT_RE.split(text):
+        while len(sent)>size:
+            cut=sent.rfind(' ',0,size); cut=cut if cut>0 else size
+            yield sent[:cut].strip(); sent=sent[cut:].strip()
+        if sent: yield sent
+
+def chunk_stream(blocks,size=None,overlap=None):
+    """Heading/sentence-aware chunks: a heading starts a new chunk, chunks break on sentence (then word)
+    boundaries at `size` chars, and each continuation repeats the section heading plus up to `overlap` chars."""
+    size=size or CHUNK_SIZE
+    overlap=min(CHUNK_OVERLAP if overlap is None else overlap,size//2)
+    cur,n,body,heading=[],0,False,''
+    for kind,text in blocks:
+        if kind=='h':
+            if body: yield ' '.join(cur); cur,n=[],0
+            heading=clean(' '.join(cur+[text])) if not body else text
+            cur,n,body=[heading],len(heading),False
+            continue
+        for sent in _sentences(text,size):
+            if body and n+1+len(sent)>size:
+                yield ' '.join(cur)
+                carry,m=[],0
+                budget=min(overlap,size-len(sent)-1)
+                for prev in reversed(cur[1:] if heading and cur and cur[0]==heading else cur):
+                    if m+len(prev)+1>budget: break
+                    carry.insert(0,prev); m+=len(prev)+1
+                if heading and len(heading)+m+len(sent)<size: carry.insert(0,heading); m+=len(heading)+1
+                cur,n=carry,m
+            cur.append(sent); n+=len(sent)+1; body=True
+    if body: yield ' '.join(cur)
+
+def open_stream(url,validators=None):
+    """Conditional streaming GET. Returns (response, validators), or (None, validators) on 304 Not Modified."""
+    validators=validators or {}
+    h={}
+    if validators.get('etag'): h['If-None-Match']=validators['etag']
+    if validators.get('last_modified'): h['If-Modified-Since']=validators['last_modified']
+    r=_http.get(url,headers=h,timeout=60,stream=True)
+    if r.status_code==304: r.close(); return None,validators
+    r.raise_for_status()
+    return r,{'etag':r.headers.get('ETag'),'last_modified':r.headers.get('Last-Modified')}
+
 def fetch(url):
-    r=requests.get(url,timeout=60); r.raise_for_status()
-    if 'html' in r.headers.get('content-type',''):
-        soup=BeautifulSoup(r.text,'lxml')
-        for s in soup(['script','style','noscript']): s.decompose()
-        return clean(soup.get_text(' '))[:200000]
-    return clean(r.text)[:200000]
+    r,_=open_stream(url)
+    with r: return '\n\n'.join(t for _,t in iter_blocks(r))
+
+def _state_key(url):
+    return 'ingest_http:'+hashlib.md5(url.encode()).hexdigest()
+
+def load_http_state(url):
+    from airflow.models import Variable
+    return Variable.get(_state_key(url),default_var={},deserialize_json=True)
+
+def save_http_state(url,validators):
+    from airflow.models import Variable
+    Variable.set(_state_key(url),validators,serialize_json=True)
 
 def chunk(txt):
-    size=1000
-    return [txt[i:i+size] for i in range(0,len(txt),size)][:200]
+    return list(chunk_stream(_text_blocks([txt])))
 
-def embed(ch):
+def embedder_kind():
+    """The embedder points should be written with: 'openai:<model>' when OPENAI_API_KEY is set, else 'hash'."""
+    return f'openai:{OPENAI_EMBED_MODEL}' if OPENAI_API_KEY else 'hash'
+
+def embed_batch(chunks):
+    """Embed a list of chunks with one API request: (vectors, embedder kind). On failure the whole batch falls back
+    to the hash embedder and the kind says so, which keeps those points out of the "unchanged" set next run."""
+    global _openai
     try:
-        if OPENAI_API_KEY:
+        if OPENAI_API_KEY and chunks:
             import openai
-            client=openai.OpenAI(api_key=OPENAI_API_KEY)
-            resp=client.embeddings.create(model='text-embedding-3-small',input=ch)
-            return resp.data[0].embedding
+            if _openai is None: _openai=openai.OpenAI(api_key=OPENAI_API_KEY)
+            resp=_openai.embeddings.create(model=OPENAI_EMBED_MODEL,input=list(chunks))
+            return np.asarray([d.embedding for d in sorted(resp.data,key=lambda d:d.index)],dtype=np.float32),embedder_kind()
     except Exception:
         pass
-    v=[0.0]*EMB_DIM
-    for tok in re.findall(r'[A-Za-z0-9_]+',ch.lower()):
-        v[hash(tok)%EMB_DIM]+=1.0
-    import math
-    n=math.sqrt(sum(x*x for x in v)) or 1.0
-    return [x/n for x in v]
+    return hash_embed_batch(chunks,EMB_DIM),'hash'
+
+def embed(ch):
+    return embed_batch([ch])[0][0].tolist()
 
 def ensure_collection():
-    r=requests.get(f"{QDRANT_URL}/collections/{QCOL}")
-    if r.status_code==200: return
-    payload={'vectors':{'size':EMB_DIM,'distance':'Cosine'}}
-    rc=requests.put(f"{QDRANT_URL}/collections/{QCOL}",json=payload); rc.raise_for_status()
+    if QCOL in _ensured: return
+    r=_http.get(f"{QDRANT_URL}/collections/{QCOL}")
+    if r.status_code!=200:
+        payload={'vectors':{'size':EMB_DIM,'distance':'Cosine'}}
+        rc=_http.put(f"{QDRANT_URL}/collections/{QCOL}",json=payload); rc.raise_for_status()
+    # keyword index on uri keeps the per-URL scroll/count/delete filters cheap; idempotent if it exists
+    _http.put(f"{QDRANT_URL}/collections/{QCOL}/index",json={'field_name':'uri','field_schema':'keyword'})
+    _ensured.add(QCOL)
+
+def _point_id(url,i):
+    return int(hashlib.md5(f"{url}-{i}".encode()).hexdigest(),16)%(2**63-1)
+
+def chunk_hash(c,module,tags,embedder=None):
+    # PAYLOAD_VERSION is part of the hash so a payload/embedding format change re-writes existing points once;
+    # so is the embedder that produced the vector, so hash-fallback points are re-embedded once OpenAI answers again
+    return hashlib.sha1(json.dumps([PAYLOAD_VERSION,c,module,sorted(tags or []),embedder or embedder_kind()]).encode()).hexdigest()
+
+def _uri_filter(url):
+    return {'must':[{'key':'uri','match':{'value':url}}]}
+
+def existing_hashes(url):
+    """{point id: content_hash} for everything currently stored for url; None for a point not written by the
+    configured embedder (hash fallback, or written before the embedder was recorded)."""
+    out,offset={},None
+    while True:
+        body={'filter':_uri_filter(url),'limit':512,'with_payload':['content_hash','embedder'],'with_vector':False}
+        if offset is not None: body['offset']=offset
+        r=_http.post(f"{QDRANT_URL}/collections/{QCOL}/points/scroll",json=body); r.raise_for_status()
+        res=r.json().get('result',{})
+        for p in res.get('points',[]):
+            pl=p.get('payload') or {}
+            out[p['id']]=pl.get('content_hash') if pl.get('embedder')==embedder_kind() else None
+        offset=res.get('next_page_offset')
+        if offset is None: return out
 
-def upsert(chunks,url,module,tags):
+def http_validators(url,have):
+    """Stored HTTP validators for a conditional GET, but only when every point of url is current: a 304 must not
+    keep hash-fallback vectors around."""
+    return load_http_state(url) if have and None not in have.values() else {}
+
+def delete_points(ids):
+    for s in range(0,len(ids),UPSERT_PAGE):
+        r=_http.post(f"{QDRANT_URL}/collections/{QCOL}/points/delete?wait=true",json={'points':ids[s:s+UPSERT_PAGE]}); r.raise_for_status()
+
+def _put_points(pts,wait):
+    r=_http.put(f"{QDRANT_URL}/collections/{QCOL}/points?wait={'true' if wait else 'false'}",json={'points':pts}); r.raise_for_status()
+
+def upsert(chunks,url,module,tags,only=None):
+    """Write chunks (or only the indices in `only`); see upsert_stream."""
+    todo=sorted(only) if only is not None else range(len(chunks))
+    return upsert_stream(((i,chunks[i]) for i in todo),url,module,tags)
+
+def _batches(items,n):
+    batch=[]
+    for it in items:
+        batch.append(it)
+        if len(batch)>=n: yield batch; batch=[]
+    if batch: yield batch
+
+def upsert_stream(items,url,module,tags):
+    """Consume (chunk index, text) pairs for one url lazily; see upsert_points."""
+    return upsert_points(((url,i,c) for i,c in items),module,tags)
+
+def upsert_points(items,module,tags):
+    """Consume (url, chunk index, text) triples lazily: embed in EMBED_BATCH requests while a writer thread
+    sends UPSERT_PAGE-sized pages to Qdrant. Qdrant applies updates in order, so only the last page waits."""
     ensure_collection()
-    pts=[]
-    for i,c in enumerate(chunks):
-        pts.append({'id':int(hashlib.md5(f"{url}-{i}".encode()).hexdigest(),16)%(2**63-1),
-                    'vector':embed(c),
-                    'payload':{'source':'url','uri':url,'chunk_index':i,'module':module,'tags':tags or []}})
-    body={'points':pts}
-    r=requests.put(f"{QDRANT_URL}/collections/{QCOL}/points?wait=true",json=body); r.raise_for_status()
-    return len(pts)
+    pages=queue.Queue(maxsize=PIPELINE_DEPTH)
+    err=[]
+    def writer():
+        while True:
+            item=pages.get()
+            if item is None: return
+            if err: continue
+            try: _put_points(*item)
+            except Exception as e: err.append(e)
+    t=threading.Thread(target=writer,name='qdrant-upsert',daemon=True); t.start()
+    pending,n=[],0
+    try:
+        for batch in _batches(items,EMBED_BATCH):
+            if err: break
+            vecs,kind=embed_batch([c for _,_,c in batch])
+            for (url,i,c),vec in zip(batch,vecs):
+                pending.append({'id':_point_id(url,i),'vector':vec.tolist(),
+                                'payload':{'source':'url','uri':url,'chunk_index':i,'module':module,'tags':tags or [],
+                                           'content_hash':chunk_hash(c,module,tags,kind),'embedder':kind,'text':c}})
+            while len(pending)>UPSERT_PAGE:
+                page,pending=pending[:UPSERT_PAGE],pending[UPSERT_PAGE:]
+                pages.put((page,False)); n+=len(page)
+        if pending and not err:
+            pages.put((pending,True)); n+=len(pending)
+    finally:
+        pages.put(None); t.join()
+    if err: raise err[0]
+    return n
+
+def changed_chunks(r,url,module,tags,have,seen,stats):
+    """body -> blocks -> chunks, yielding only (index, text) whose content hash differs from `have`.
+    Fills `seen` with every current point id and counts chunks/unchanged into `stats`."""
+    for i,c in enumerate(chunk_stream(iter_blocks(r))):
+        if MAX_CHUNKS and i>=MAX_CHUNKS: break
+        pid=_point_id(url,i); seen.add(pid); stats['chunks']+=1
+        if have.get(pid)==chunk_hash(c,module,tags): stats['unchanged']+=1
+        else: yield i,c
 
 def run(url,module='Unknown',tags=None,**ctx):
-    text=fetch(url)
-    ch=chunk(text)
-    n=upsert(ch,url,module,tags or [])
-    return {'chunks':len(ch),'upserted':n}
+    """Incremental ingest: conditional GET, then embed/upsert only chunks whose content hash changed
+    and delete points of chunks that no longer exist."""
+    tags=tags or []
+    ensure_collection()
+    have=existing_hashes(url)
+    validators=http_validators(url,have)
+    r,validators=open_stream(url,validators)
+    if r is None:
+        return {'chunks':len(have),'upserted':0,'unchanged':len(have),'deleted':0,'not_modified':True}
+    seen=set(); stats={'chunks':0,'unchanged':0}
+    with r:
+        n=upsert_stream(changed_chunks(r,url,module,tags,have,seen,stats),url,module,tags)
+    stale=sorted(set(have)-seen)
+    if stale: delete_points(stale)
+    save_http_state(url,validators)
+    return dict(stats,upserted=n,deleted=len(stale),not_modified=False)
 
 with DAG('ingest_document',start_date=datetime(2025,1,1),schedule_interval=None,catchup=False) as dag:
     t=PythonOperator(task_id='ingest_url',python_callable=run,
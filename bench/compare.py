@@ -0,0 +1,48 @@
+import sys,json,argparse
+
+# metric -> (path into a scenario, higher is better, absolute noise floor below which a change is ignored)
+METRICS={'p50_ms':(('latency_ms','p50'),False,2.0),'p95_ms':(('latency_ms','p95'),False,5.0),
+         'p99_ms':(('latency_ms','p99'),False,5.0),'rps':(('throughput_rps',),True,0.5),
+         'peak_rss_mb':(('rss_mb','peak'),False,8.0)}
+
+def _get(d,path):
+    for p in path:
+        if not isinstance(d,dict): return None
+        d=d.get(p)
+    return d
+
+def compare(base,new,threshold=0.15):
+    """Rows (scenario, metric, base, new, relative change, regressed) for scenarios present in both runs.
+    A metric regresses when it is worse by more than `threshold` (fraction) and by more than its noise floor."""
+    rows=[]
+    for name in sorted(set(base['scenarios'])&set(new['scenarios'])):
+        b,n=base['scenarios'][name],new['scenarios'][name]
+        for metric,(path,higher,floor) in METRICS.items():
+            bv,nv=_get(b,path),_get(n,path)
+            if bv is None or nv is None: continue
+            delta=(nv-bv)/bv if bv else 0.0
+            worse=(bv-nv) if higher else (nv-bv)
+            rows.append((name,metric,bv,nv,delta,worse>abs(bv)*threshold and worse>floor))
+        if n.get('errors',0)>b.get('errors',0):
+            rows.append((name,'errors',b.get('errors',0),n['errors'],0.0,True))
+    return rows
+
+def main(argv=None):
+    ap=argparse.ArgumentParser(prog='python -m bench.compare',description='Compare two bench.run result files')
+    ap.add_argument('base'); ap.add_argument('new')
+    ap.add_argument('--threshold',type=float,default=0.15,help='relative change counted as a regression (default 0.15)')
+    args=ap.parse_args(argv)
+    with open(args.base,encoding='utf-8') as f: base=json.load(f)
+    with open(args.new,encoding='utf-8') as f: new=json.load(f)
+    print(f"base {base['meta'].get('commit')}  new {new['meta'].get('commit')}  threshold {args.threshold:.0%}")
+    rows=compare(base,new,args.threshold)
+    for name,metric,bv,nv,delta,bad in rows:
+        print(f"{name:48s} {metric:12s} {round(bv,2):>10} {round(nv,2):>10} {delta:>+8.1%}{'  REGRESSION' if bad else ''}")
+    only=sorted(set(base['scenarios'])^set(new['scenarios']))
+    if only: print('not compared (only in one run):',', '.join(only))
+    bad=sum(r[5] for r in rows)
+    print(f'{bad} regression(s)' if bad else 'no regressions')
+    return 1 if bad else 0
+
+if __name__=='__main__':
+    sys.exit(main())
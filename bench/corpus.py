@@ -0,0 +1,72 @@
+import os,random
+import yaml
+
+# Deterministic synthetic inputs: the same (size, seed) always produces byte-identical files, so results
+# from different commits are comparable.
+
+VOCAB=('ASN','LPN','GRN','putaway','replenishment','wave','pick','pack','ship','dock','door','yard','slot','bin','zone',
+       'cycle','count','inventory','pallet','carton','SKU','lot','serial','expiry','FEFO','FIFO','cross-dock','staging',
+       'receiving','inspection','quarantine','label','GS1-128','RF','scanner','handheld','IDoc','SAP','ERP','carrier',
+       'manifest','tote','conveyor','sorter','latency','throughput','audit','tenant','warehouse','shift','labor','task')
+MODULES=('Inbound','Outbound','Inventory')
+INTEGRATIONS=('SAP S/4 (IDoc ASN, GR)','Zebra Printer (GS1-128)','Carrier API (label, manifest)','TMS (dock appointments)',
+              'Oracle EBS (receipts)','Shopify (orders)','Conveyor PLC (OPC-UA)','Scale (weight check)')
+
+# name -> (KB files, paragraphs per file) and requirement sizes as (integrations, extra sections, items per section)
+KB_SIZES={'s':(4,6),'m':(40,12),'l':(200,20)}
+YAML_SIZES={'s':(2,0,0),'m':(6,4,10),'l':(8,12,40)}
+
+def _sentence(rng,words=14):
+    s=' '.join(rng.choice(VOCAB) for _ in range(words))
+    return s[0].upper()+s[1:]+'.'
+
+def _paragraph(rng):
+    return ' '.join(_sentence(rng,rng.randint(8,20)) for _ in range(rng.randint(2,6)))
+
+def make_kb(path,size='s',seed=7):
+    """Write a markdown KB of KB_SIZES[size] into path. Returns the list of files."""
+    files,paras=KB_SIZES[size]
+    rng=random.Random(f'kb-{size}-{seed}')
+    os.makedirs(path,exist_ok=True)
+    out=[]
+    for i in range(files):
+        mod=MODULES[i%len(MODULES)]
+        body=[f'# {mod} notes {i}']
+        for j in range(paras):
+            if j%4==0: body.append(f'## {rng.choice(VOCAB).title()} {j}')
+            body.append(_paragraph(rng))
+        p=os.path.join(path,f'{mod.lower()}_{i:04d}.md')
+        with open(p,'w',encoding='utf-8') as f: f.write('\n\n'.join(body)+'\n')
+        out.append(p)
+    return out
+
+def kb_chunks(path):
+    """(uri, chunk index, text) for every chunk of a KB dir, chunked like the orchestrator's BM25 index."""
+    from orchestrator.rag_simple import load_kb,_chunk
+    return [(p,i,c) for p,text in load_kb(path) for i,c in enumerate(_chunk(text))]
+
+def make_requirement(size='s',seed=7,module='Inbound',nonce=None):
+    """A requirement YAML string shaped like samples/requirement.yaml, grown by YAML_SIZES[size].
+    `nonce` makes otherwise identical requirements distinct (defeats the pack/LLM caches)."""
+    n_int,sections,items=YAML_SIZES[size]
+    rng=random.Random(f'yaml-{size}-{seed}')
+    data={'project':f'Bench {size.upper()}','domain':'WMS','module':module,
+          'integrations':list(INTEGRATIONS[:n_int]),'users':rng.choice((50,200,1000)),'warehouses':rng.randint(1,20),
+          'constraints':{'latency_scan_ms':rng.choice((150,300,800)),'offline_mobile':True},
+          'tech':{'backend':'NestJS','db':'Postgres','mq':'RabbitMQ','web':'Next.js','mobile':'Android (Kotlin)'},
+          'non_functional':{'uptime':'99.9%','audit':True}}
+    for s in range(sections):
+        data[f'process_{s}']=[{'step':f'{rng.choice(VOCAB)} {k}','notes':_sentence(rng)} for k in range(items)]
+    if nonce is not None: data['bench_nonce']=str(nonce)
+    return yaml.safe_dump(data,sort_keys=False)
+
+def make_page(size='s',seed=7,index=0):
+    """An HTML page for the ingest benchmark: headings + paragraphs, roughly 2/20/200 KB for s/m/l."""
+    sections={'s':3,'m':25,'l':250}[size]
+    rng=random.Random(f'page-{size}-{seed}-{index}')
+    parts=[f'<html><head><title>Bench page {index}</title><style>p{{margin:0}}</style></head><body>']
+    for s in range(sections):
+        parts.append(f'<h2>{rng.choice(VOCAB).title()} section {s}</h2>')
+        parts.extend(f'<p>{_paragraph(rng)}</p>' for _ in range(3))
+    parts.append('</body></html>')
+    return '\n'.join(parts).encode('utf-8')
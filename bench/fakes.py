@@ -0,0 +1,173 @@
+import sys,json,re,time,math,hashlib,threading
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+from urllib.parse import urlsplit
+try:
+    import numpy as np
+except ImportError:
+    np=None
+
+# Local stand-ins for every network dependency of /generate and the ingest DAG, so benchmarks run offline
+# and their latency is controlled: an Ollama + OpenAI-compatible LLM, a Qdrant subset and a document server.
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads=True
+    allow_reuse_address=True
+    request_queue_size=256
+
+    def handle_error(self,request,client_address):
+        # clients giving up mid-response (timeouts under test) are expected, not worth a traceback
+        if not isinstance(sys.exc_info()[1],(BrokenPipeError,ConnectionResetError)):
+            super().handle_error(request,client_address)
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version='HTTP/1.1'
+    def log_message(self,*a): pass
+
+    def _body(self):
+        n=int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(n)) if n else {}
+
+    def _json(self,obj,status=200):
+        out=json.dumps(obj).encode()
+        self.send_response(status); self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(out))); self.end_headers(); self.wfile.write(out)
+
+    def _chunked(self,ctype,pieces):
+        self.send_response(200); self.send_header('Content-Type',ctype); self.send_header('Transfer-Encoding','chunked'); self.end_headers()
+        for p in pieces:
+            if p: self.wfile.write(b'%x\r\n%s\r\n'%(len(p),p)); self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+def serve(handler,**config):
+    """Start `handler` on an ephemeral localhost port in a daemon thread. Returns (server, base_url);
+    `config` becomes server.config, shared by all requests (e.g. latency_ms)."""
+    srv=_Server(('127.0.0.1',0),handler)
+    srv.config=config; srv.state={}; srv.lock=threading.Lock()
+    threading.Thread(target=srv.serve_forever,name=handler.__name__,daemon=True).start()
+    return srv,f'http://127.0.0.1:{srv.server_address[1]}'
+
+class FakeLLM(_Handler):
+    """Ollama /api/generate + /api/version and OpenAI /v1/chat/completions, /v1/embeddings + /v1/models/<id>.
+    config: latency_ms (time to first token), token_ms (per streamed token), tokens (completion length), dim
+    (embedding size)."""
+    WORDS=('Assume','ASN','arrives','via','IDoc;','putaway','rules','are','configured','per','zone.')
+
+    def _tokens(self):
+        c=self.server.config
+        time.sleep(c.get('latency_ms',50)/1000.0)
+        n=c.get('tokens',64)
+        return [self.WORDS[i%len(self.WORDS)]+' ' for i in range(n)]
+
+    def _pace(self,toks):
+        delay=self.server.config.get('token_ms',0)/1000.0
+        for t in toks:
+            if delay: time.sleep(delay)
+            yield t
+
+    def do_GET(self):
+        path=urlsplit(self.path).path
+        if path=='/api/version': return self._json({'version':'bench'})
+        if path.startswith('/v1/models/'): return self._json({'id':path.rsplit('/',1)[1],'object':'model','created':0,'owned_by':'bench'})
+        self._json({'error':'not found'},404)
+
+    def do_POST(self):
+        body=self._body(); path=urlsplit(self.path).path
+        if path=='/api/generate':
+            toks=self._tokens()
+            if not body.get('stream'):
+                return self._json({'response':''.join(self._pace(toks)),'done':True})
+            last=len(toks)-1
+            return self._chunked('application/x-ndjson',((json.dumps({'response':t,'done':i==last})+'\n').encode()
+                                                          for i,t in enumerate(self._pace(toks))))
+        if path.endswith('/chat/completions'):
+            toks=self._tokens()
+            if not body.get('stream'):
+                return self._json({'id':'bench','object':'chat.completion','created':int(time.time()),'model':body.get('model'),
+                                   'choices':[{'index':0,'finish_reason':'stop','message':{'role':'assistant','content':''.join(self._pace(toks))}}],
+                                   'usage':{'prompt_tokens':0,'completion_tokens':len(toks),'total_tokens':len(toks)}})
+            def sse():
+                for t in self._pace(toks):
+                    yield ('data: '+json.dumps({'id':'bench','object':'chat.completion.chunk','created':0,'model':body.get('model'),
+                                                'choices':[{'index':0,'delta':{'content':t},'finish_reason':None}]})+'\n\n').encode()
+                yield b'data: [DONE]\n\n'
+            return self._chunked('text/event-stream',sse())
+        if path.endswith('/embeddings'):
+            time.sleep(self.server.config.get('latency_ms',50)/1000.0)
+            inp=body.get('input'); inp=[inp] if isinstance(inp,str) else inp
+            dim=self.server.config.get('dim',1536)
+            data=[{'object':'embedding','index':i,'embedding':_pseudo_vector(t,dim)} for i,t in enumerate(inp)]
+            return self._json({'object':'list','data':data,'model':body.get('model'),'usage':{'prompt_tokens':0,'total_tokens':0}})
+        self._json({'error':'not found'},404)
+
+def _pseudo_vector(text,dim):
+    seed=hashlib.sha256(text.encode()).digest()
+    v=[((seed[i%32]^(i*31))%255)/127.0-1.0 for i in range(dim)]
+    n=math.sqrt(sum(x*x for x in v)) or 1.0
+    return [x/n for x in v]
+
+class FakeQdrant(_Handler):
+    """In-memory subset of the Qdrant REST API used here: collection get/create/index, points upsert, scroll
+    (uri filter + offset), delete and search (dot product, `must` match filters). config: latency_ms per request."""
+
+    def _delay(self):
+        ms=self.server.config.get('latency_ms',0)
+        if ms: time.sleep(ms/1000.0)
+
+    def _points(self):
+        return self.server.state.setdefault('points',{})
+
+    def do_GET(self):
+        self._delay()
+        if re.match(r'^/collections/[^/]+$',urlsplit(self.path).path):
+            return self._json({'result':{'status':'green','points_count':len(self._points())},'status':'ok'})
+        self._json({'status':{'error':'not found'}},404)
+
+    def do_PUT(self):
+        self._delay(); body=self._body(); path=urlsplit(self.path).path
+        if path.endswith('/points'):
+            with self.server.lock:
+                for p in body.get('points',[]): self._points()[p['id']]=p
+            return self._json({'result':{'status':'completed'},'status':'ok'})
+        self._json({'result':True,'status':'ok'})
+
+    def do_POST(self):
+        self._delay(); body=self._body(); path=urlsplit(self.path).path
+        with self.server.lock: pts=list(self._points().values())
+        match=lambda p: all(_match(p.get('payload') or {},c) for c in (body.get('filter') or {}).get('must',[]))
+        if path.endswith('/points/scroll'):
+            pts=sorted((p for p in pts if match(p)),key=lambda p:p['id'])
+            off=body.get('offset'); lim=body.get('limit',10)
+            if off is not None: pts=[p for p in pts if p['id']>=off]
+            page,rest=pts[:lim],pts[lim:]
+            return self._json({'result':{'points':[{'id':p['id'],'payload':p.get('payload')} for p in page],
+                                         'next_page_offset':rest[0]['id'] if rest else None},'status':'ok'})
+        if path.endswith('/points/delete'):
+            with self.server.lock:
+                for i in body.get('points',[]): self._points().pop(i,None)
+            return self._json({'result':{'status':'completed'},'status':'ok'})
+        if path.endswith('/points/search'):
+            cand=[p for p in pts if match(p)]; q=body.get('vector') or []
+            if np is not None and cand: scores=(np.asarray([p['vector'] for p in cand],dtype=np.float32)@np.asarray(q,dtype=np.float32)).tolist()
+            else: scores=[sum(a*b for a,b in zip(q,p['vector'])) for p in cand]
+            scored=sorted(zip(scores,cand),key=lambda x:-x[0])[:body.get('limit',10)]
+            return self._json({'result':[{'id':p['id'],'score':s,'payload':p.get('payload')} for s,p in scored],'status':'ok'})
+        self._json({'status':{'error':'not found'}},404)
+
+def _match(payload,cond):
+    v=payload.get(cond.get('key'))
+    want=(cond.get('match') or {}).get('value')
+    return want in v if isinstance(v,list) else v==want
+
+class FakeDocs(_Handler):
+    """Serves state['docs'] {path: (content type, bytes)} with an ETag and If-None-Match support."""
+
+    def do_GET(self):
+        time.sleep(self.server.config.get('latency_ms',0)/1000.0)
+        doc=self.server.state.get('docs',{}).get(urlsplit(self.path).path)
+        if doc is None: return self._json({'error':'not found'},404)
+        ctype,body=doc
+        etag='"%s"'%hashlib.md5(body).hexdigest()
+        if self.headers.get('If-None-Match')==etag:
+            self.send_response(304); self.send_header('ETag',etag); self.send_header('Content-Length','0'); self.end_headers(); return
+        self.send_response(200); self.send_header('Content-Type',ctype); self.send_header('ETag',etag)
+        self.send_header('Content-Length',str(len(body))); self.end_headers(); self.wfile.write(body)
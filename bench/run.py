@@ -0,0 +1,314 @@
+import os,sys,json,time,types,socket,platform,argparse,tempfile,threading,subprocess
+from concurrent.futures import ThreadPoolExecutor
+from bench import corpus, fakes
+
+ROOT=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+RESULTS_DIR=os.path.join(ROOT,'bench','results')
+
+# ---------- measurement helpers ----------
+
+def percentile(sorted_vals,q):
+    if not sorted_vals: return 0.0
+    pos=(len(sorted_vals)-1)*q/100.0
+    lo=int(pos); hi=min(lo+1,len(sorted_vals)-1)
+    return sorted_vals[lo]+(sorted_vals[hi]-sorted_vals[lo])*(pos-lo)
+
+def summarize(values):
+    v=sorted(values)
+    if not v: return {'n':0}
+    return {'n':len(v),'mean':round(sum(v)/len(v),2),'p50':round(percentile(v,50),2),'p95':round(percentile(v,95),2),
+            'p99':round(percentile(v,99),2),'max':round(v[-1],2)}
+
+def rss_mb(pid='self'):
+    """(current, peak) resident set size in MB for a process (Linux /proc; peak-only fallback elsewhere)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            st=dict(l.split(':',1) for l in f if ':' in l)
+        kb=lambda k: int(st[k].split()[0])/1024.0
+        return round(kb('VmRSS'),1),round(kb('VmHWM'),1)
+    except (OSError,KeyError):
+        import resource
+        peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/(1024.0 if sys.platform!='darwin' else 1024.0*1024)
+        return None,round(peak,1)
+
+def reset_peak_rss(pid='self'):
+    # Linux: writing 5 to clear_refs resets VmHWM, making the peak per scenario instead of per process
+    try:
+        with open(f'/proc/{pid}/clear_refs','w') as f: f.write('5')
+    except OSError:
+        pass
+
+def drive(fn,n,concurrency):
+    """Call fn(i) for i in range(n) from `concurrency` threads. fn returns a timings dict (may be empty).
+    Returns ([(ok, latency ms, timings, error)], wall seconds)."""
+    out=[None]*n
+    def one(i):
+        t0=time.perf_counter()
+        try: tm,err=fn(i),None
+        except Exception as e: tm,err=None,f'{type(e).__name__}: {e}'
+        out[i]=(err is None,(time.perf_counter()-t0)*1000,tm or {},err)
+    t0=time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency,thread_name_prefix='bench') as tp:
+        list(tp.map(one,range(n)))
+    return out,time.perf_counter()-t0
+
+def report(results,wall,rss_pid=None,rss_before=None,extra=None):
+    ok=[r for r in results if r[0]]
+    stages={}
+    for r in ok:
+        for k,v in r[2].items():
+            if k.endswith('_ms'): stages.setdefault(k[:-3],[]).append(v)
+    cur,peak=rss_mb(rss_pid) if rss_pid else (None,None)
+    out={'requests':len(results),'errors':len(results)-len(ok),'wall_s':round(wall,3),
+         'throughput_rps':round(len(ok)/wall,2) if wall else 0.0,
+         'latency_ms':summarize([r[1] for r in ok]),
+         'stages_ms':{k:summarize(v) for k,v in sorted(stages.items())},
+         'rss_mb':{'before':rss_before,'after':cur,'peak':peak}}
+    errs=[r[3] for r in results if not r[0]]
+    if errs: out['first_error']=errs[0]
+    out.update(extra or {})
+    return out
+
+# ---------- environment: fakes + synthetic data, set up before any orchestrator import ----------
+
+def setup(args,tmp):
+    """Start the fake services and point the orchestrator/DAG env at them. Returns the fake servers."""
+    env={}
+    llm,llm_url=fakes.serve(fakes.FakeLLM,latency_ms=args.llm_latency_ms,token_ms=args.token_ms,tokens=args.tokens)
+    qdrant,qdrant_url=fakes.serve(fakes.FakeQdrant,latency_ms=args.qdrant_latency_ms)
+    kb_dir=os.path.join(tmp,'kb'); corpus.make_kb(kb_dir,args.kb)
+    env.update(OLLAMA_URL=llm_url,OPENAI_BASE_URL=llm_url+'/v1',WMS_KB_DIR=kb_dir,QDRANT_COLLECTION='bench',
+               WMS_OUT_DIR=os.path.join(tmp,'out'),LLM_CACHE_PATH=os.path.join(tmp,'llm_cache.sqlite'),
+               JINJA_CACHE_DIR=os.path.join(tmp,'jinja'),RETRIEVAL_MODE=args.retrieval)
+    if args.provider=='openai': env['OPENAI_API_KEY']='bench'
+    if args.retrieval in ('vector','hybrid','auto'): env['QDRANT_URL']=qdrant_url
+    else: os.environ.pop('QDRANT_URL',None)
+    os.environ.update(env)
+    return {'llm':llm,'qdrant':qdrant,'qdrant_url':qdrant_url,'kb_dir':kb_dir,'env':env}
+
+def preload_qdrant(srv,kb_dir):
+    # KB chunks as points of the fake collection, so vector/hybrid retrieval has something to rank
+    from orchestrator.embedder import embed_batch
+    chunks=corpus.kb_chunks(kb_dir)
+    vecs=embed_batch([c for _,_,c in chunks]) if chunks else []
+    pts=srv.state.setdefault('points',{})
+    for n,((uri,i,c),v) in enumerate(zip(chunks,vecs)):
+        mod=os.path.basename(uri).split('_')[0].title()
+        pts[n]={'id':n,'vector':v.tolist(),'payload':{'uri':uri,'chunk_index':i,'module':mod,'tags':[],'text':c}}
+    return len(pts)
+
+# ---------- generate ----------
+
+def _generate_body(args,size,i):
+    nonce=None if args.repeat else f'{size}-{i}'
+    return {'requirement_yaml':corpus.make_requirement(size,nonce=nonce),'module':'Inbound','llm_provider':args.provider,
+            'retrieval':args.retrieval}
+
+def _wait(proc,url,path,timeout=30.0):
+    """Poll url+path until it answers 200; returns the wait in ms."""
+    import requests
+    t0=time.perf_counter()
+    while time.perf_counter()-t0<timeout:
+        try:
+            if requests.get(url+path,timeout=1).ok: return (time.perf_counter()-t0)*1000
+        except requests.RequestException: pass
+        if proc.poll() is not None: raise RuntimeError('uvicorn exited during startup')
+        time.sleep(0.005)
+    proc.kill(); raise RuntimeError(f'uvicorn did not answer {path} in {timeout}s')
+
+def _spawn_server(env,workers=1):
+    s=socket.socket(); s.bind(('127.0.0.1',0)); port=s.getsockname()[1]; s.close()
+    proc=subprocess.Popen([sys.executable,'-m','uvicorn','orchestrator.main:app','--port',str(port),'--workers',str(workers),
+                           '--log-level','warning'],cwd=ROOT,env=dict(os.environ,**env))
+    return proc,f'http://127.0.0.1:{port}'
+
+def _start_server(env,workers):
+    proc,url=_spawn_server(env,workers)
+    _wait(proc,url,'/readyz')
+    return proc,url
+
+def bench_generate(args,ctx):
+    results={}
+    if args.mode=='inproc':
+        from fastapi.testclient import TestClient
+        from orchestrator.main import app
+        client=TestClient(app); client.__enter__()  # starts the warm-up
+        while client.get('/readyz').status_code!=200: time.sleep(0.01)
+        post=lambda body: client.post('/generate',json=body)
+        pid,proc='self',None
+    else:
+        import requests
+        proc,url=(None,args.url) if args.url else _start_server(ctx['env'],args.workers)
+        local=threading.local()
+        def post(body):
+            s=getattr(local,'s',None)
+            if s is None: s=local.s=requests.Session()
+            return s.post(url+'/generate',json=body,timeout=300)
+        pid=proc.pid if proc else None
+    try:
+        for size in args.sizes:
+            for c in args.concurrency:
+                def call(i,size=size,c=c):
+                    r=post(_generate_body(args,size,f'c{c}-{i}'))
+                    if r.status_code!=200: raise RuntimeError(f'HTTP {r.status_code}: {r.text[:200]}')
+                    return r.json().get('timings') or {}
+                for w in range(args.warmup): call(f'warm{w}')
+                before=None
+                if pid: reset_peak_rss(pid); before=rss_mb(pid)[0]
+                res,wall=drive(call,args.requests,c)
+                name=f'generate/{args.mode}/{args.provider}/{args.retrieval}/{size}/c{c}'
+                results[name]=report(res,wall,pid,before)
+                _print(name,results[name])
+    finally:
+        if args.mode=='inproc': client.__exit__(None,None,None)
+        if proc: proc.terminate(); proc.wait(10)
+    return results
+
+# ---------- startup ----------
+
+IMPORT_SNIPPET='import time; t=time.perf_counter(); import orchestrator.main; print((time.perf_counter()-t)*1000)'
+
+def bench_startup(args,ctx):
+    """Fresh processes only: import time of orchestrator.main, then per WMS_WARMUP mode the time until /healthz and
+    /readyz answer and the latency of the first and second /generate."""
+    import requests
+    env=dict(os.environ,**ctx['env'])
+    results={}
+    imports=[float(subprocess.check_output([sys.executable,'-c',IMPORT_SNIPPET],cwd=ROOT,env=env)) for _ in range(args.startup_runs)]
+    results['startup/import']={'requests':len(imports),'errors':0,'latency_ms':summarize(imports),'rss_mb':{'peak':None}}
+    _print('startup/import',results['startup/import'])
+    for warm in ('off','background'):
+        runs={'healthz':[],'readyz':[],'first':[],'second':[]}; peak=[]; errs=[]
+        for n in range(args.startup_runs):
+            proc,url=_spawn_server(dict(ctx['env'],WMS_WARMUP=warm))
+            try:
+                runs['healthz'].append(_wait(proc,url,'/healthz')); runs['readyz'].append(runs['healthz'][-1]+_wait(proc,url,'/readyz'))
+                for which in ('first','second'):
+                    body=_generate_body(args,args.sizes[0],f'{warm}-{n}-{which}')
+                    t0=time.perf_counter(); r=requests.post(url+'/generate',json=body,timeout=300)
+                    if r.status_code!=200: errs.append(f'HTTP {r.status_code}: {r.text[:200]}')
+                    runs[which].append((time.perf_counter()-t0)*1000)
+                peak.append(rss_mb(proc.pid)[1])
+            finally:
+                proc.terminate(); proc.wait(10)
+        name=f'startup/{warm}/first_request'
+        results[name]={'requests':len(runs['first']),'errors':len(errs),'latency_ms':summarize(runs['first']),
+                       'second_request_ms':summarize(runs['second']),'healthz_ms':summarize(runs['healthz']),
+                       'readyz_ms':summarize(runs['readyz']),'rss_mb':{'peak':max((p for p in peak if p),default=None)}}
+        if errs: results[name]['first_error']=errs[0]
+        _print(name,results[name])
+        print(f"   healthz p50={results[name]['healthz_ms'].get('p50')} readyz p50={results[name]['readyz_ms'].get('p50')} "
+              f"second p50={results[name]['second_request_ms'].get('p50')} ms",flush=True)
+    return results
+
+# ---------- ingest ----------
+
+def _load_dag():
+    """Import the ingest DAG module. Without Airflow installed, minimal stand-ins for the DAG/operator classes are
+    registered so run() can be profiled offline; HTTP validator state is kept in memory either way."""
+    sys.path.insert(0,os.path.join(ROOT,'airflow','dags'))
+    try:
+        from airflow import DAG  # noqa: F401
+    except ImportError:  # also when only the repo's airflow/ folder is importable (as a namespace package)
+        class DAG:
+            def __init__(self,*a,**kw): pass
+            def __enter__(self): return self
+            def __exit__(self,*a): pass
+        af=types.ModuleType('airflow'); af.DAG=DAG
+        ops=types.ModuleType('airflow.operators'); py=types.ModuleType('airflow.operators.python')
+        py.PythonOperator=lambda **kw: None
+        sys.modules.update({'airflow':af,'airflow.operators':ops,'airflow.operators.python':py})
+    import ingest_document as dag
+    state={}
+    dag.load_http_state=lambda url: state.get(url,{})
+    dag.save_http_state=lambda url,v: state.__setitem__(url,v)
+    return dag
+
+def bench_ingest(args,ctx):
+    os.environ['QDRANT_URL']=ctx['qdrant_url']
+    dag=_load_dag()
+    dag.QDRANT_URL=ctx['qdrant_url']
+    docs,docs_url=fakes.serve(fakes.FakeDocs,latency_ms=args.doc_latency_ms)
+    results={}
+    for size in args.sizes:
+        for c in args.concurrency:
+            dag.QCOL=f'bench_{size}_c{c}'
+            pages={f'/docs/{size}/c{c}/{i}.html':('text/html; charset=utf-8',corpus.make_page(size,index=i)) for i in range(args.pages)}
+            docs.state['docs']=pages
+            urls=[docs_url+p for p in pages]
+            for phase in ('cold','unchanged'):
+                counters={}
+                lock=threading.Lock()
+                def call(i):
+                    t=time.perf_counter(); out=dag.run(urls[i],module='Inbound',tags=['bench'])
+                    with lock:
+                        for k,v in out.items(): counters[k]=counters.get(k,0)+int(v)
+                    return {'run_ms':(time.perf_counter()-t)*1000}
+                reset_peak_rss(); before=rss_mb()[0]
+                res,wall=drive(call,len(urls),c)
+                name=f'ingest/{size}/{phase}/c{c}'
+                results[name]=report(res,wall,'self',before,extra={'counters':counters,
+                                     'chunks_per_s':round(counters.get('chunks',0)/wall,1) if wall else 0.0})
+                _print(name,results[name])
+    docs.shutdown()
+    return results
+
+# ---------- CLI ----------
+
+def _print(name,r):
+    lat=r['latency_ms']
+    print(f"{name:48s} n={r['requests']:<4d} err={r['errors']:<3d} rps={r.get('throughput_rps','-'):<8} "
+          f"p50={lat.get('p50','-')} p95={lat.get('p95','-')} p99={lat.get('p99','-')} ms  peak_rss={r['rss_mb']['peak']} MB",flush=True)
+    if r.get('first_error'): print('   first error:',r['first_error'],flush=True)
+
+def _git(*a):
+    try: return subprocess.check_output(['git',*a],cwd=ROOT,stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError,subprocess.CalledProcessError): return None
+
+def main(argv=None):
+    ap=argparse.ArgumentParser(prog='python -m bench.run',description='Offline benchmark for /generate, the ingest DAG and cold start')
+    ap.add_argument('suite',choices=['generate','ingest','startup','all'])
+    ap.add_argument('--mode',choices=['inproc','http'],default='inproc',help='generate: TestClient in-process or uvicorn over HTTP')
+    ap.add_argument('--url',help='generate --mode http against an already running server instead of spawning uvicorn')
+    ap.add_argument('--workers',type=int,default=1,help='uvicorn workers when spawning the server')
+    ap.add_argument('--sizes',default='s,m',help='comma-separated synthetic sizes: s,m,l')
+    ap.add_argument('--concurrency',default='1,8',help='comma-separated client concurrency levels')
+    ap.add_argument('--requests',type=int,default=40,help='generate requests per scenario')
+    ap.add_argument('--warmup',type=int,default=2)
+    ap.add_argument('--repeat',action='store_true',help='send identical requirements (measures the cached path)')
+    ap.add_argument('--provider',choices=['none','ollama','openai'],default='ollama')
+    ap.add_argument('--retrieval',choices=['auto','lexical','vector','hybrid'],default='lexical')
+    ap.add_argument('--kb',choices=sorted(corpus.KB_SIZES),default='m',help='synthetic KB size')
+    ap.add_argument('--llm-latency-ms',type=float,default=200)
+    ap.add_argument('--token-ms',type=float,default=0)
+    ap.add_argument('--tokens',type=int,default=64)
+    ap.add_argument('--qdrant-latency-ms',type=float,default=2)
+    ap.add_argument('--doc-latency-ms',type=float,default=20)
+    ap.add_argument('--pages',type=int,default=20,help='ingest pages per scenario')
+    ap.add_argument('--startup-runs',type=int,default=5,help='fresh processes per startup scenario')
+    ap.add_argument('--out',help='result file (default bench/results/<commit>-<timestamp>.json)')
+    args=ap.parse_args(argv)
+    args.sizes=[s for s in args.sizes.split(',') if s]
+    args.concurrency=[int(c) for c in args.concurrency.split(',') if c]
+    for s in args.sizes:
+        if s not in corpus.YAML_SIZES: ap.error(f'unknown size {s}')
+
+    tmp=tempfile.mkdtemp(prefix='wms_bench_')
+    ctx=setup(args,tmp)
+    if 'QDRANT_URL' in ctx['env']: preload_qdrant(ctx['qdrant'],ctx['kb_dir'])
+    commit=_git('rev-parse','--short','HEAD')
+    meta={'commit':commit,'dirty':bool(_git('status','--porcelain','--untracked-files=no')),'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),
+          'python':platform.python_version(),'platform':platform.platform(),'cpus':os.cpu_count(),
+          'args':{k:v for k,v in vars(args).items() if k!='out'}}
+    scenarios={}
+    if args.suite in ('generate','all'): scenarios.update(bench_generate(args,ctx))
+    if args.suite in ('ingest','all'): scenarios.update(bench_ingest(args,ctx))
+    if args.suite in ('startup','all'): scenarios.update(bench_startup(args,ctx))
+    out=args.out or os.path.join(RESULTS_DIR,f"{commit or 'nogit'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)),exist_ok=True)
+    with open(out,'w',encoding='utf-8') as f: json.dump({'meta':meta,'scenarios':scenarios},f,indent=2)
+    print('results written to',out)
+    return out
+
+if __name__=='__main__':
+    main()
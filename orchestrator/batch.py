@@ -0,0 +1,28 @@
+import os,json,time,threading,multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from orchestrator.tools.render import render_artifacts, warm_templates
+from orchestrator.tools.validators import validate_artifacts
+
+BATCH_WORKERS=int(os.environ.get('BATCH_WORKERS','0')) or os.cpu_count() or 1
+
+_pool=None
+_pool_lock=threading.Lock()
+
+def get_pool():
+    # 'spawn' so workers never inherit the parent's render thread pool or open sockets mid-state
+    global _pool
+    if _pool is None or _pool._broken:
+        with _pool_lock:
+            if _pool is None or _pool._broken:
+                _pool=ProcessPoolExecutor(max_workers=BATCH_WORKERS,mp_context=multiprocessing.get_context('spawn'),initializer=warm_templates)
+    return _pool
+
+def render_and_validate(module,data,extra,out_dir=None):
+    """Process-pool task: render + validate one design pack. Returns (artifacts, validation, timings)."""
+    t0=time.perf_counter()
+    artifacts=render_artifacts(module,data,extra=extra,out_dir=out_dir)
+    t1=time.perf_counter()
+    validation=validate_artifacts(module,artifacts)
+    artifacts['validation_report.json']=json.dumps(validation,indent=2)
+    t2=time.perf_counter()
+    return artifacts,validation,{'render_ms':round((t1-t0)*1000,1),'validate_ms':round((t2-t1)*1000,1)}
@@ -0,0 +1,167 @@
+import os, re, math
+from collections import namedtuple
+from functools import lru_cache
+from orchestrator.metrics import inc
+try:
+    import tiktoken  # optional: exact BPE counts; without it tokens are estimated
+except ImportError:
+    tiktoken = None
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_BUDGETS = os.getenv("CONTEXT_BUDGETS", "ollama=800")  # provider[:model]=tokens,...
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+CONTEXT_CACHE_ITEMS = int(os.getenv("CONTEXT_CACHE_ITEMS", "4096"))
+
+# Context packer: ranked retrieval snippets in, one prompt-ready block out that fits a token budget.
+# Near-duplicate snippets (overlapping chunks, the same page ingested twice) are dropped, repeated sentences are
+# kept once, and when the rest still does not fit, the sentences most relevant to the query are kept, each in
+# its original place. Sentence splitting and token counts are cached per snippet text.
+
+Snippet = namedtuple("Snippet", "label text score")
+
+_TERM_RE = re.compile(r"[a-z0-9_]+")
+_SENT_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(\[])")
+_PIECE_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+_SHINGLE = 3
+
+def _parse_budgets(spec: str):
+    out = {}
+    for part in spec.split(","):
+        name, _, n = part.partition("=")
+        if name.strip() and n.strip():
+            out[name.strip().lower()] = int(n)
+    return out
+
+_BUDGETS = _parse_budgets(CONTEXT_BUDGETS)
+
+def budget_for(provider: str, model: str = None) -> int:
+    """Token budget for KB context sent to `provider`/`model`: CONTEXT_BUDGETS entry for provider:model, then
+    for provider, else CONTEXT_TOKEN_BUDGET."""
+    provider = (provider or "none").lower()
+    return _BUDGETS.get(f"{provider}:{(model or '').lower()}", _BUDGETS.get(provider, CONTEXT_TOKEN_BUDGET))
+
+@lru_cache(maxsize=64)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model or "")
+    except Exception:
+        return tiktoken.get_encoding("cl100k_base")
+
+def _estimate(text: str) -> int:
+    # roughly BPE: a short word is one token, long words split every ~6 letters, digits in groups of 3
+    return sum(1 + (len(p) - 1) // 6 if p[0].isalpha() else 1 for p in _PIECE_RE.findall(text))
+
+def count_tokens(text: str, model: str = None) -> int:
+    enc = _encoding(model)
+    return len(enc.encode(text, disallowed_special=())) if enc is not None else _estimate(text)
+
+def _terms(text: str):
+    return _TERM_RE.findall(text.lower())
+
+def _sentences(text: str):
+    # (sentence, starts a line); lines are kept apart so markdown lists and headings survive packing
+    out = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        for i, s in enumerate(_SENT_RE.split(line) if line else ()):
+            out.append((s, i == 0))
+    return out
+
+@lru_cache(maxsize=CONTEXT_CACHE_ITEMS)
+def _analyse(text: str, model: str = None):
+    """(sentences as (text, starts a line, tokens, terms), word shingles, tokens of the whole text)."""
+    sents = tuple((s, first, count_tokens(s, model), frozenset(_terms(s))) for s, first in _sentences(text))
+    words = _terms(text)
+    shingles = frozenset(hash(tuple(words[i:i + _SHINGLE])) for i in range(max(1, len(words) - _SHINGLE + 1)))
+    return sents, shingles, count_tokens(text.strip(), model)
+
+def _near_dup(a, b) -> bool:
+    # containment rather than Jaccard, so a chunk that overlaps most of a longer one also counts
+    return len(a & b) >= CONTEXT_DEDUP_THRESHOLD * min(len(a), len(b))
+
+def _header(s: Snippet) -> str:
+    return f"### {s.label} (score={s.score:.3f})"
+
+def pack(query: str, snippets, budget: int, model: str = None):
+    """Pack ranked snippets (best first) into at most `budget` tokens of context for `model`.
+    Returns (context text, stats) where stats counts tokens_in (every snippet in full), tokens_out, tokens_saved,
+    snippets_in/out and near-duplicate snippets dropped."""
+    snippets = [s for s in snippets if s.text and s.text.strip()]
+    tokens_in = sum(count_tokens(_header(s), model) + 1 + _analyse(s.text, model)[2] for s in snippets)
+    tokens_in += 2 * max(0, len(snippets) - 1)
+    kept, dups = [], 0
+    for s in snippets:
+        a = _analyse(s.text, model)
+        if any(_near_dup(a[1], b[1]) for _, b in kept):
+            dups += 1
+            continue
+        kept.append((s, a))
+
+    # candidate sentences, each exact repeat kept only where it ranks highest; a markdown heading is not a
+    # candidate itself but comes along with the first sentence chosen under it
+    seen, cands, heads_of = set(), [], {}
+    for i, (s, a) in enumerate(kept):
+        heading = None
+        for j, (text, first, tokens, terms) in enumerate(a[0]):
+            c = (i, j, text, first, tokens, terms)
+            if first and text.startswith("#"):
+                heading = c
+                continue
+            norm = text.lower()
+            if norm in seen:
+                continue
+            seen.add(norm)
+            cands.append(c)
+            heads_of[c] = heading
+    q = set(_terms(query))
+    df = {t: sum(1 for c in cands if t in c[5]) for t in q}
+    idf = {t: math.log(1 + len(cands) / n) for t, n in df.items() if n}
+
+    def priority(c):
+        i, j, _, _, tokens, terms = c
+        rel = sum(idf.get(t, 0.0) for t in q & terms) / math.sqrt(max(tokens, 4))
+        return rel + 0.05 / (i + 1) + (0.02 if j == 0 else 0.0)
+
+    heads = [count_tokens(_header(s), model) + 3 for s, _ in kept]  # + newline and snippet separator
+    headings = {h for h in heads_of.values() if h is not None}
+    full = sum(heads) + sum(c[4] + 1 for c in cands) + sum(h[4] + 1 for h in headings)
+    if full <= budget:
+        chosen = cands + list(headings)
+    else:
+        chosen, used, opened = [], 0, set()
+        for c in sorted(cands, key=lambda c: (-priority(c), c[0], c[1])):
+            h = heads_of[c]
+            extra = [h] if h is not None and h not in opened else []
+            cost = c[4] + 1 + sum(x[4] + 1 for x in extra) + (0 if c[0] in opened else heads[c[0]])
+            if used + cost <= budget:
+                chosen += [c] + extra; used += cost; opened.update([c[0]] + extra)
+
+    def render(chosen):
+        parts = []
+        for i, (s, _) in enumerate(kept):
+            body, prev = "", None
+            for c in sorted((c for c in chosen if c[0] == i), key=lambda c: c[1]):
+                # a heading always ends its line, even when the sentence chosen under it did not start one
+                body += c[2] if not body else ("\n" if c[3] or prev in headings else " ") + c[2]
+                prev = c
+            if body:
+                parts.append(f"{_header(s)}\n{body}")
+        return "\n\n".join(parts)
+
+    text = render(chosen)
+    tokens_out = count_tokens(text, model) if text else 0
+    while tokens_out > budget and chosen:
+        # per-sentence counts are additive only approximately; drop the least relevant until it fits
+        c = min((c for c in chosen if c not in headings), key=priority, default=None)
+        rest = [x for x in chosen if x is not c and x not in headings]
+        kept_heads = {heads_of[x] for x in rest}  # a heading stays only while a sentence under it does
+        chosen = rest + [h for h in chosen if h in headings and h in kept_heads]
+        text = render(chosen)
+        tokens_out = count_tokens(text, model) if text else 0
+    saved = max(0, tokens_in - tokens_out)
+    inc("wms_context_tokens_in_total", tokens_in)
+    inc("wms_context_tokens_saved_total", saved)
+    return text, {"budget": budget, "tokens_in": tokens_in, "tokens_out": tokens_out, "tokens_saved": saved,
+                  "snippets_in": len(snippets), "snippets_out": len({c[0] for c in chosen}), "duplicates": dups}
@@ -0,0 +1,59 @@
+import os,re,hashlib
+from functools import lru_cache
+try:
+    import numpy as np
+except ImportError:  # optional extra, see setup_extras.sh; embed() still works without it
+    np=None
+
+# Deterministic signed feature hashing, shared by ingestion (Airflow DAG) and retrieval so both sides agree.
+# Features are lowercased word tokens plus, optionally, word n-grams up to EMBED_NGRAMS. Each feature is hashed
+# with blake2b (stable across processes, unlike built-in hash()) to 64 bits: the value mod dim picks the column,
+# the top bit the sign, so collisions cancel out on average instead of piling up.
+
+EMB_DIM=int(os.environ.get('EMBED_DIM','1536'))
+EMBED_NGRAMS=int(os.environ.get('EMBED_NGRAMS','1'))
+_TOKEN_RE=re.compile(r'[A-Za-z0-9_]+')
+
+@lru_cache(maxsize=1<<17)
+def feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'),digest_size=8).digest(),'little')
+
+def features(text,ngrams=None):
+    toks=_TOKEN_RE.findall(text.lower())
+    out=list(toks)
+    for n in range(2,(ngrams or EMBED_NGRAMS)+1):
+        out.extend(' '.join(toks[i:i+n]) for i in range(len(toks)-n+1))
+    return out
+
+def normalize(m):
+    """L2-normalise the rows of a float matrix in place (all-zero rows stay zero)."""
+    norms=np.linalg.norm(m,axis=-1,keepdims=True)
+    norms[norms==0]=1.0
+    m/=norms
+    return m
+
+def embed_batch(texts,dim=None,ngrams=None,l2=True,out=None):
+    """Embed many texts with one scatter: float32 [len(texts), dim]. Pass `out` to fill a preallocated matrix."""
+    dim=dim or EMB_DIM
+    rows,hashes=[],[]
+    for i,t in enumerate(texts):
+        f=features(t,ngrams)
+        rows.extend([i]*len(f)); hashes.extend(map(feature_hash,f))
+    n=len(texts)
+    h=np.fromiter(hashes,dtype=np.uint64,count=len(hashes))
+    cols=(h%np.uint64(dim)).astype(np.intp)
+    signs=np.where(h>>np.uint64(63),-1.0,1.0)
+    flat=np.bincount(np.asarray(rows,dtype=np.intp)*dim+cols,weights=signs,minlength=n*dim)
+    if out is None: out=np.empty((n,dim),dtype=np.float32)
+    out[...]=flat.reshape(n,dim)
+    return normalize(out) if l2 else out
+
+def embed(text,dim=None,ngrams=None,l2=True):
+    """One text as a list of floats (pure Python when numpy is not installed)."""
+    dim=dim or EMB_DIM
+    if np is not None: return embed_batch([text],dim,ngrams,l2)[0].tolist()
+    v=[0.0]*dim
+    for f in features(text,ngrams):
+        h=feature_hash(f); v[h%dim]+=-1.0 if h>>63 else 1.0
+    n=sum(x*x for x in v)**0.5 if l2 else 0.0
+    return [x/n for x in v] if n else v
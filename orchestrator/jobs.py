@@ -0,0 +1,112 @@
+import os,time,uuid,asyncio,threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+JOB_WORKERS=int(os.environ.get('JOB_WORKERS','4'))
+JOB_QUEUE_DEPTH=int(os.environ.get('JOB_QUEUE_DEPTH','16'))
+JOB_HISTORY=int(os.environ.get('JOB_HISTORY','256'))
+STAGES=['rag','llm','render','validate','zip']
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self,kind):
+        self.id=uuid.uuid4().hex[:12]
+        self.kind=kind
+        self.status='queued'
+        self.created=time.time()
+        self.stages=OrderedDict((s,{'status':'pending'}) for s in STAGES)
+        self.result=None
+        self.error=None
+        self.events=[]
+        self._lock=threading.Lock()
+        self._waiters=[]
+
+    @property
+    def finished(self): return self.status in ('done','error')
+
+    def _publish(self,event,**data):
+        with self._lock:
+            if event=='status': self.status=data['status']
+            self.events.append(dict(event=event,**data))
+            waiters,self._waiters=self._waiters,[]
+        for loop,ev in waiters:
+            loop.call_soon_threadsafe(ev.set)
+
+    async def wait(self,seen):
+        """Wait until there are more than `seen` events (or the job is finished)."""
+        loop=asyncio.get_running_loop(); ev=asyncio.Event()
+        with self._lock:
+            if len(self.events)>seen or self.finished: return
+            self._waiters.append((loop,ev))
+        await ev.wait()
+
+    @contextmanager
+    def stage(self,name):
+        st=self.stages.setdefault(name,{'status':'pending'})
+        st['status']='running'; t0=time.perf_counter()
+        self._publish('stage',stage=name,status='running')
+        try:
+            yield
+        except Exception:
+            st['status']='error'; st['ms']=round((time.perf_counter()-t0)*1000,1)
+            self._publish('stage',stage=name,status='error',ms=st['ms'])
+            raise
+        st['status']='done'; st['ms']=round((time.perf_counter()-t0)*1000,1)
+        self._publish('stage',stage=name,status='done',ms=st['ms'])
+
+    def snapshot(self):
+        done=sum(1 for s in self.stages.values() if s['status'] in ('done','skipped'))
+        return {'job_id':self.id,'kind':self.kind,'status':self.status,'created':self.created,
+                'progress':round(done/len(self.stages),3) if self.stages else 0.0,
+                'stages':{k:dict(v) for k,v in self.stages.items()},'result':self.result,'error':self.error}
+
+class JobManager:
+    """Bounded executor for long-running jobs: at most JOB_WORKERS running and JOB_QUEUE_DEPTH waiting."""
+
+    def __init__(self,workers=JOB_WORKERS,queue_depth=JOB_QUEUE_DEPTH,history=JOB_HISTORY):
+        self._pool=ThreadPoolExecutor(max_workers=workers,thread_name_prefix='job')
+        self._capacity=workers+queue_depth
+        self._history=history
+        self._active=0
+        self._jobs=OrderedDict()
+        self._lock=threading.Lock()
+
+    def submit(self,kind,fn,*args,**kw):
+        """Queue fn(job, *args, **kw); its return value becomes job.result. Raises QueueFull when saturated."""
+        job=Job(kind)
+        with self._lock:
+            if self._active>=self._capacity: raise QueueFull(f'{self._active} jobs in flight')
+            self._active+=1
+            self._jobs[job.id]=job
+            self._evict()
+        self._pool.submit(self._run,job,fn,args,kw)
+        return job
+
+    def _evict(self):
+        for jid in list(self._jobs):
+            if len(self._jobs)<=self._history: break
+            if self._jobs[jid].finished: del self._jobs[jid]
+
+    def _run(self,job,fn,args,kw):
+        job._publish('status',status='running')
+        try:
+            job.result=fn(job,*args,**kw)
+            for s in job.stages.values():
+                if s['status']=='pending': s['status']='skipped'
+            status='done'
+        except Exception as e:
+            job.error=getattr(e,'detail',None) or str(e) or e.__class__.__name__
+            status='error'
+        finally:
+            with self._lock: self._active-=1
+        job._publish('status',status=status,error=job.error)
+
+    def get(self,job_id):
+        return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {'active':self._active,'capacity':self._capacity,'tracked':len(self._jobs)}
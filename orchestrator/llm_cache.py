@@ -0,0 +1,151 @@
+import os, json, time, sqlite3, hashlib, tempfile, threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+LLM_CACHE = os.getenv("LLM_CACHE", "1").lower() not in ("0", "false", "no")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(tempfile.gettempdir(), "wms_llm_cache.sqlite"))
+LLM_CACHE_MEM_ITEMS = int(os.getenv("LLM_CACHE_MEM_ITEMS", "256"))
+LLM_CACHE_DISK_MB = float(os.getenv("LLM_CACHE_DISK_MB", "64"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+
+def cache_key(provider, model, system_prompt, user_prompt, max_tokens, temperature) -> str:
+    raw = json.dumps([provider, model, system_prompt, user_prompt, max_tokens, temperature], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """Two-tier completion cache: in-memory LRU in front of a size-capped SQLite file, with TTL and singleflight."""
+
+    def __init__(self, path=LLM_CACHE_PATH, mem_items=LLM_CACHE_MEM_ITEMS, disk_mb=LLM_CACHE_DISK_MB, ttl=LLM_CACHE_TTL):
+        self.ttl = ttl
+        self.mem_items = mem_items
+        self.disk_bytes = int(disk_mb * 1024 * 1024)
+        self._mem = OrderedDict()  # key -> (created, value)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.stats = {"mem_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        self._db = None
+        self._bytes = 0  # running total of the size column, so put() never sums the table
+        if path and self.disk_bytes > 0:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL, size INTEGER)")
+                self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed)")
+                self._db.commit()
+                self._bytes = self._db.execute("SELECT COALESCE(SUM(size),0) FROM llm_cache").fetchone()[0]
+            except sqlite3.Error:
+                self._db = None
+
+    def _fresh(self, created, now):
+        return self.ttl <= 0 or now - created < self.ttl
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                if self._fresh(hit[0], now):
+                    self._mem.move_to_end(key); self.stats["mem_hits"] += 1
+                    return hit[1]
+                del self._mem[key]
+        if self._db is None:
+            return None
+        with self._db_lock:
+            try:
+                row = self._db.execute("SELECT value, created, size FROM llm_cache WHERE key=?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if not self._fresh(row[1], now):
+                    self._db.execute("DELETE FROM llm_cache WHERE key=?", (key,)); self._db.commit()
+                    self._bytes -= row[2]
+                    return None
+                self._db.execute("UPDATE llm_cache SET accessed=? WHERE key=?", (now, key)); self._db.commit()
+            except sqlite3.Error:
+                return None
+        self._remember(key, row[1], row[0])
+        with self._lock: self.stats["disk_hits"] += 1
+        return row[0]
+
+    def _remember(self, key, created, value):
+        with self._lock:
+            self._mem[key] = (created, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.mem_items:
+                self._mem.popitem(last=False); self.stats["evictions"] += 1
+
+    def put(self, key, value):
+        if value is None:
+            return  # nothing to cache; get() reads None as a miss anyway
+        now = time.time()
+        self._remember(key, now, value)
+        if self._db is None:
+            return
+        size = len(value.encode("utf-8"))
+        with self._db_lock:
+            try:
+                old = self._db.execute("SELECT size FROM llm_cache WHERE key=?", (key,)).fetchone()
+                self._db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?,?,?,?,?)", (key, value, now, now, size))
+                total = self._bytes + size - (old[0] if old else 0)
+                if total > self.disk_bytes:
+                    # drop least recently used rows until we are back under budget; the file may be shared with
+                    # other processes, so start from the exact sum on this (rare) path
+                    total = self._db.execute("SELECT COALESCE(SUM(size),0) FROM llm_cache").fetchone()[0]
+                    for k, sz in self._db.execute("SELECT key, size FROM llm_cache ORDER BY accessed").fetchall():
+                        if total <= self.disk_bytes: break
+                        self._db.execute("DELETE FROM llm_cache WHERE key=?", (k,))
+                        total -= sz; self.stats["evictions"] += 1
+                self._db.commit()
+                self._bytes = total
+            except sqlite3.Error:
+                pass
+
+    def get_or_compute(self, key, fn):
+        """Return the cached value or call fn() once; concurrent callers with the same key share that call."""
+        val = self.get(key)
+        if val is not None:
+            return val
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            return fut.result()
+        try:
+            val = fn()
+            self.put(key, val)
+            fut.set_result(val)
+            return val
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock: self._inflight.pop(key, None)
+
+    def snapshot(self):
+        with self._lock:
+            out = dict(self.stats, mem_items=len(self._mem), inflight=len(self._inflight))
+        lookups = out["mem_hits"] + out["disk_hits"] + out["misses"] + out["coalesced"]
+        out["hit_ratio"] = round((lookups - out["misses"]) / lookups, 4) if lookups else 0.0
+        if self._db is not None:
+            with self._db_lock:
+                try:
+                    out["disk_items"], out["disk_bytes"] = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size),0) FROM llm_cache").fetchone()
+                except sqlite3.Error:
+                    pass
+        return out
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None: _cache = LLMCache()
+    return _cache
@@ -1,5 +1,46 @@
+import os, json, time, threading
+from orchestrator.llm_cache import LLM_CACHE, cache_key, get_cache
+from orchestrator.metrics import inc, observe, span
+from orchestrator.llm_guard import get_guard
 
-import os
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+
+# Provider clients are created once per process and shared, so every call reuses pooled keep-alive connections.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _client(name, factory):
+    c = _clients.get(name)
+    if c is None:
+        with _clients_lock:
+            c = _clients.get(name)
+            if c is None:
+                c = _clients[name] = factory()
+    return c
+
+def _openai_client():
+    def make():
+        import openai  # type: ignore
+        # no SDK retries: the provider guard's deadline bounds each call, and a retry would run past it unseen
+        return openai.OpenAI(max_retries=0)
+    return _client("openai", make)
+
+def _gemini_model(model: str):
+    def make():
+        import google.generativeai as genai  # type: ignore
+        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+        return genai.GenerativeModel(model)
+    return _client(f"gemini:{model}", make)
+
+def _ollama_session():
+    def make():
+        import requests  # type: ignore
+        s = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_SIZE)
+        s.mount("http://", adapter); s.mount("https://", adapter)
+        return s
+    return _client("ollama", make)
 
 class LLMClient:
     def __init__(self, provider: str = "none", model: str = None):
@@ -9,6 +50,7 @@ class LLMClient:
             "gemini": os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
             "ollama": os.getenv("OLLAMA_MODEL", "llama3"),
         }.get(self.provider, "none")
+        self.fell_back = False  # the last complete()/stream_complete() answered with fallback text
 
     def available(self) -> bool:
         if self.provider == "openai":
@@ -19,49 +61,138 @@ class LLMClient:
             return True
         return False
 
-    def complete(self, system_prompt: str, user_prompt: str, max_tokens: int = 600) -> str:
-        if self.provider == "none" or not self.available():
+    def warm(self, timeout: float = 5.0):
+        """Create the shared provider client (importing its SDK) and, where it costs no tokens, open a pooled
+        connection, so the first real call pays neither. Returns False for an unavailable provider."""
+        if not self.available():
+            return False
+        if self.provider == "openai":
+            _openai_client().with_options(timeout=timeout).models.retrieve(self.model)
+        elif self.provider == "gemini":
+            _gemini_model(self.model)
+        elif self.provider == "ollama":
+            _ollama_session().get(f"{OLLAMA_URL}/api/version", timeout=timeout).raise_for_status()
+        return True
+
+    def complete(self, system_prompt: str, user_prompt: str, max_tokens: int = 600,
+                 temperature: float = 0.2, use_cache: bool = True) -> str:
+        self.fell_back = False
+        if self.provider not in ("openai", "gemini", "ollama") or not self.available():
             return self._fallback(user_prompt)
+        call = lambda: self._timed_call(system_prompt, user_prompt, max_tokens, temperature)
+        try:
+            if use_cache and LLM_CACHE:
+                key = cache_key(self.provider, self.model, system_prompt, user_prompt, max_tokens, temperature)
+                return get_cache().get_or_compute(key, call)
+            return call()
+        except Exception as e:
+            # errors are never cached; every caller of a failed flight falls back on its own prompt
+            inc("wms_llm_fallbacks_total", provider=self.provider)
+            return self._fallback(user_prompt, err=str(e))
+
+    def stream_complete(self, system_prompt: str, user_prompt: str, max_tokens: int = 600,
+                        temperature: float = 0.2, use_cache: bool = True):
+        """Like complete(), but yields text pieces as the provider produces them."""
+        self.fell_back = False
+        if self.provider not in ("openai", "gemini", "ollama") or not self.available():
+            yield self._fallback(user_prompt); return
+        key = cache_key(self.provider, self.model, system_prompt, user_prompt, max_tokens, temperature) if use_cache and LLM_CACHE else None
+        if key:
+            hit = get_cache().get(key)
+            if hit is not None:
+                yield hit; return
+        parts = []
+        t0 = time.perf_counter()
+        try:
+            with get_guard(self.provider).admit() as ticket:
+                t1 = time.perf_counter()
+                for piece in self._stream(system_prompt, user_prompt, max_tokens, temperature, ticket.deadline):
+                    if piece:
+                        if not parts:
+                            ticket.latency = time.perf_counter() - t1
+                            observe("wms_llm_first_token_seconds", time.perf_counter() - t0, provider=self.provider)
+                        parts.append(piece); yield piece
+        except Exception as e:
+            inc("wms_llm_fallbacks_total", provider=self.provider)
+            self.fell_back = True  # also when the stream broke off after some pieces
+            yield self._fallback(user_prompt, err=str(e)) if not parts else f"\\n\\n[FALLBACK {e}]"
+            return
+        finally:
+            observe("wms_llm_stream_seconds", time.perf_counter() - t0, provider=self.provider)
+        if key and parts:
+            get_cache().put(key, "".join(parts))
+
+    def _timed_call(self, system_prompt: str, user_prompt: str, max_tokens: int, temperature: float) -> str:
+        # one upstream call (cache hits never get here), admitted by the provider's guard (concurrency limit,
+        # adaptive deadline, circuit breaker): wms_span_seconds{span="llm_call",provider=...}
+        with get_guard(self.provider).admit() as ticket, span("llm_call", provider=self.provider):
+            return self._call(system_prompt, user_prompt, max_tokens, temperature, ticket.deadline)
 
+    def _call(self, system_prompt: str, user_prompt: str, max_tokens: int, temperature: float, timeout: float = 60) -> str:
         if self.provider == "openai":
-            try:
-                import openai  # type: ignore
-                client = openai.OpenAI()
-                resp = client.chat.completions.create(
-                    model=self.model,
-                    messages=[{"role":"system","content":system_prompt},
-                              {"role":"user","content":user_prompt}],
-                    temperature=0.2,
-                    max_tokens=max_tokens
-                )
-                return resp.choices[0].message.content
-            except Exception as e:
-                return self._fallback(user_prompt, err=str(e))
+            resp = _openai_client().chat.completions.create(
+                model=self.model,
+                messages=[{"role":"system","content":system_prompt},
+                          {"role":"user","content":user_prompt}],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout
+            )
+            return resp.choices[0].message.content or ""  # None for e.g. a refusal or a tool call
 
         if self.provider == "gemini":
-            try:
-                import google.generativeai as genai  # type: ignore
-                genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-                model = genai.GenerativeModel(self.model)
-                resp = model.generate_content([system_prompt, user_prompt])
-                return resp.text
-            except Exception as e:
-                return self._fallback(user_prompt, err=str(e))
+            resp = _gemini_model(self.model).generate_content([system_prompt, user_prompt], request_options={"timeout": timeout})
+            return resp.text
 
         if self.provider == "ollama":
-            try:
-                import requests  # type: ignore
-                r = requests.post("http://localhost:11434/api/generate",
-                                  json={"model": self.model, "prompt": f"{system_prompt}\n\n{user_prompt}","stream":False},
-                                  timeout=60)
-                if r.ok:
-                    return r.json().get("response","").strip()
-                return self._fallback(user_prompt, err=r.text)
-            except Exception as e:
-                return self._fallback(user_prompt, err=str(e))
-
-        return self._fallback(user_prompt)
+            r = _ollama_session().post(f"{OLLAMA_URL}/api/generate",
+                                       json={"model": self.model, "prompt": f"{system_prompt}\n\n{user_prompt}","stream":False},
+                                       timeout=timeout)
+            if r.ok:
+                return r.json().get("response","").strip()
+            raise RuntimeError(r.text)
+
+        raise ValueError(f"Unsupported provider: {self.provider}")
+
+    def _stream(self, system_prompt: str, user_prompt: str, max_tokens: int, temperature: float, timeout: float = 60):
+        # `timeout` bounds the wait for each piece, not the whole stream
+        if self.provider == "openai":
+            resp = _openai_client().chat.completions.create(
+                model=self.model,
+                messages=[{"role":"system","content":system_prompt},
+                          {"role":"user","content":user_prompt}],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                timeout=timeout
+            )
+            for chunk in resp:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
+            return
+
+        if self.provider == "gemini":
+            for chunk in _gemini_model(self.model).generate_content([system_prompt, user_prompt], stream=True,
+                                                                   request_options={"timeout": timeout}):
+                yield chunk.text
+            return
+
+        if self.provider == "ollama":
+            with _ollama_session().post(f"{OLLAMA_URL}/api/generate",
+                                        json={"model": self.model, "prompt": f"{system_prompt}\n\n{user_prompt}","stream":True},
+                                        timeout=timeout, stream=True) as r:
+                if not r.ok:
+                    raise RuntimeError(r.text)
+                for line in r.iter_lines():
+                    if not line: continue
+                    msg = json.loads(line)
+                    yield msg.get("response","")
+                    if msg.get("done"): break
+            return
+
+        raise ValueError(f"Unsupported provider: {self.provider}")
 
     def _fallback(self, user_prompt: str, err: str = "") -> str:
+        self.fell_back = True
         note = f"\\n\\n[FALLBACK {err}]" if err else ""
         return (user_prompt[:800] + note)
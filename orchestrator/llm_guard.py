@@ -0,0 +1,158 @@
+import os, time, threading
+from collections import deque
+from contextlib import contextmanager
+from orchestrator.metrics import inc, gauge_add
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "2"))
+LLM_TIMEOUT_MIN = float(os.getenv("LLM_TIMEOUT_MIN", "5"))
+LLM_TIMEOUT_MAX = float(os.getenv("LLM_TIMEOUT_MAX", "60"))
+LLM_TIMEOUT_P95_FACTOR = float(os.getenv("LLM_TIMEOUT_P95_FACTOR", "2"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "100"))
+LLM_TIMEOUT_MIN_SAMPLES = int(os.getenv("LLM_TIMEOUT_MIN_SAMPLES", "10"))
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class Rejected(Exception):
+    """The call was not sent upstream: the circuit is open or all of the provider's slots stayed busy."""
+    def __init__(self, provider, reason):
+        super().__init__(f"{provider} {reason.replace('_', ' ')}")
+        self.reason = reason
+
+class Ticket:
+    """Handed to the caller of admit(): `deadline` is the upstream timeout in seconds; set `latency` (seconds)
+    to record something other than the whole call, e.g. time to first token for a stream."""
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.latency = None
+
+class ProviderGuard:
+    """Admission control for one LLM provider: a concurrency limit, a deadline of p95 latency x factor (clamped to
+    [LLM_TIMEOUT_MIN, LLM_TIMEOUT_MAX]) and a circuit breaker over the recent error rate. An open circuit rejects
+    calls for LLM_BREAKER_COOLDOWN seconds, then lets one probe through (half-open): success closes it, failure
+    opens it again."""
+
+    def __init__(self, provider, max_concurrency=LLM_MAX_CONCURRENCY):
+        self.provider = provider
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._latency = deque(maxlen=LLM_LATENCY_WINDOW)
+        self._outcomes = deque(maxlen=LLM_BREAKER_WINDOW)  # True = error
+        self.state = CLOSED
+        self._opened = 0.0
+        self._probing = False
+        self.inflight = 0
+        gauge_add("wms_llm_circuit_state", 0, provider=provider)
+
+    def _set_state(self, state):
+        # caller holds self._lock
+        if state == self.state: return
+        gauge_add("wms_llm_circuit_state", _STATE_VALUE[state] - _STATE_VALUE[self.state], provider=self.provider)
+        inc("wms_llm_circuit_transitions_total", provider=self.provider, state=state)
+        self.state = state
+        if state == OPEN:
+            self._opened = time.monotonic()
+        if state != HALF_OPEN:
+            self._probing = False
+        if state == CLOSED:
+            self._outcomes.clear()
+
+    def deadline(self):
+        with self._lock:
+            lat = sorted(self._latency)
+        if len(lat) < LLM_TIMEOUT_MIN_SAMPLES:
+            return LLM_TIMEOUT_MAX
+        p95 = lat[int(0.95 * (len(lat) - 1))]
+        return min(LLM_TIMEOUT_MAX, max(LLM_TIMEOUT_MIN, p95 * LLM_TIMEOUT_P95_FACTOR))
+
+    def _enter(self):
+        # (admitted, is the half-open probe)
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened >= LLM_BREAKER_COOLDOWN:
+                self._set_state(HALF_OPEN)
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+                return False, False
+            probe = self.state == HALF_OPEN
+            if probe:
+                self._probing = True
+            return True, probe
+
+    def _record(self, error, elapsed, deadline, probe):
+        with self._lock:
+            # timed-out calls count at their deadline too, so a provider that slows down for good raises its p95
+            # (and the next deadline) instead of failing forever
+            if not error or elapsed >= deadline * 0.9:
+                self._latency.append(elapsed)
+            if probe:
+                self._set_state(OPEN if error else CLOSED)
+                return
+            if self.state != CLOSED:
+                return
+            self._outcomes.append(error)
+            n = len(self._outcomes)
+            if n >= LLM_BREAKER_MIN_CALLS and sum(self._outcomes) / n >= LLM_BREAKER_ERROR_RATE:
+                self._set_state(OPEN)
+
+    @contextmanager
+    def admit(self):
+        """Reserve a slot for one upstream call and yield a Ticket; raises Rejected instead of calling a provider
+        whose circuit is open or whose slots stay busy for LLM_QUEUE_TIMEOUT seconds."""
+        admitted, probe = self._enter()
+        if not admitted:
+            inc("wms_llm_rejected_total", provider=self.provider, reason="circuit_open")
+            raise Rejected(self.provider, "circuit_open")
+        if not self._slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+            if probe:
+                with self._lock: self._probing = False
+            inc("wms_llm_rejected_total", provider=self.provider, reason="saturated")
+            raise Rejected(self.provider, "saturated")
+        ticket = Ticket(LLM_TIMEOUT_MAX if probe else self.deadline())  # a probe may find the provider slow but alive
+        with self._lock: self.inflight += 1
+        gauge_add("wms_llm_inflight", 1, provider=self.provider)
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield ticket
+        except Exception:
+            error = True
+            raise
+        except BaseException:
+            # GeneratorExit from an abandoned stream or a cancelled request: neither success nor provider failure
+            if probe:
+                with self._lock: self._probing = False
+            raise
+        else:
+            error = False
+        finally:
+            with self._lock: self.inflight -= 1
+            gauge_add("wms_llm_inflight", -1, provider=self.provider)
+            self._slots.release()
+            if error is not None:
+                elapsed = time.perf_counter() - t0
+                self._record(error, elapsed if error or ticket.latency is None else ticket.latency, ticket.deadline, probe)
+
+    def snapshot(self):
+        d = self.deadline()
+        with self._lock:
+            n = len(self._outcomes)
+            return {"state": self.state, "inflight": self.inflight, "deadline_s": round(d, 2),
+                    "error_rate": round(sum(self._outcomes) / n, 3) if n else 0.0, "latency_samples": len(self._latency)}
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+def get_guard(provider):
+    g = _guards.get(provider)
+    if g is None:
+        with _guards_lock:
+            g = _guards.get(provider)
+            if g is None: g = _guards[provider] = ProviderGuard(provider)
+    return g
+
+def snapshot():
+    return {name: g.snapshot() for name, g in list(_guards.items())}
@@ -1,19 +1,38 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any, List
-import yaml, os, json, uuid, requests
-from orchestrator.tools.render import render_designpack
-from orchestrator.tools.exporter import export_zip
-from orchestrator.tools.validators import validate_openapi, check_api_vs_erd, check_nfr_vs_deployment
+import os, json, uuid, time, zipfile, importlib, threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from orchestrator.tools.render import render_artifacts, warm_templates, affected_artifacts
+from orchestrator.tools.exporter import stream_zip
+from orchestrator.tools.validators import validate_artifacts
+from orchestrator.tools.validation import rules_for
 from orchestrator.llm_client import LLMClient
-from orchestrator.rag_simple import load_kb as load_kb_simple, build_context as build_ctx_simple
-from orchestrator.retriever_qdrant import build_context as build_ctx_qdrant
+from orchestrator.llm_cache import get_cache as get_llm_cache
+from orchestrator.llm_guard import snapshot as llm_guard_snapshot
+from orchestrator.jobs import JobManager, QueueFull
+from orchestrator.batch import BATCH_WORKERS, get_pool as batch_pool, render_and_validate
+from orchestrator.output_store import pack_key, get_store as get_output_store
+from orchestrator.rag_simple import get_index as kb_index
+from orchestrator.context_packer import Snippet, pack as pack_context, budget_for as context_budget, count_tokens
+from orchestrator.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, collect, span, server_timing, render as render_metrics
 
 AIRFLOW_API_URL=os.environ.get('AIRFLOW_API_URL','http://localhost:8080/api/v1')
 AIRFLOW_USERNAME=os.environ.get('AIRFLOW_USERNAME','airflow')
 AIRFLOW_PASSWORD=os.environ.get('AIRFLOW_PASSWORD','airflow')
 QDRANT_URL=os.environ.get('QDRANT_URL')
+LOCAL_VECTOR_DIR=os.environ.get('LOCAL_VECTOR_DIR')
+KB_DIR=os.path.abspath(os.environ.get('WMS_KB_DIR') or os.path.join(os.path.dirname(__file__),'..','kb'))
+PERSIST_OUTPUTS=os.environ.get('WMS_PERSIST','0').lower() in ('1','true','yes')
+MEM_SESSIONS=int(os.environ.get('WMS_MEM_SESSIONS','128'))
+BATCH_MAX_ITEMS=int(os.environ.get('BATCH_MAX_ITEMS','64'))
+RETRIEVAL_MODE=os.environ.get('RETRIEVAL_MODE','auto')
+RETRIEVAL_MODES=('auto','lexical','vector','hybrid')
+WARMUP=os.environ.get('WMS_WARMUP','background').lower()  # background | blocking | off
+WARM_PROVIDERS=[p for p in os.environ.get('WMS_WARM_PROVIDERS','').lower().split(',') if p]
 
 class IngestURLRequest(BaseModel):
     url: str
@@ -22,6 +41,16 @@ class IngestURLRequest(BaseModel):
 class IngestURLResponse(BaseModel):
     ok: bool
     dag_run_id: str
+class IngestBulkRequest(BaseModel):
+    urls: List[str] = []
+    sitemap: Optional[str] = None  # sitemap (or sitemap index) URL, expanded inside the DAG run
+    module: Optional[str] = 'Unknown'
+    tags: Optional[List[str]] = []
+    per_host: Optional[int] = None  # max concurrent fetches per host; DAG default BULK_PER_HOST
+class IngestBulkResponse(BaseModel):
+    ok: bool
+    dag_run_id: str
+    urls: int
 
 class GenerateRequest(BaseModel):
     requirement_yaml: str
@@ -29,79 +58,575 @@ class GenerateRequest(BaseModel):
     llm_provider: str = 'none'
     llm_model: Optional[str] = None
     use_rag: bool = True
+    retrieval: Optional[str] = None  # auto | lexical | vector | hybrid; defaults to RETRIEVAL_MODE
+    persist: Optional[bool] = None  # keep the ZIP in the on-disk pack store under WMS_OUT_DIR; defaults to WMS_PERSIST
+    stream_zip: bool = False  # respond with the ZIP itself instead of JSON
+    stream_assumptions: bool = False  # respond with NDJSON: LLM tokens as they arrive, then the result
+    context_budget: Optional[int] = Field(None, ge=1)  # max tokens of KB snippets in the prompt; defaults per provider/model (CONTEXT_BUDGETS)
 class GenerateResponse(BaseModel):
     ok: bool
-    out_dir: str
-    zip_path: str
+    out_dir: Optional[str] = None
+    zip_path: Optional[str] = None
     files: List[str]
     validation: Dict[str, Any]
     session_id: str
     download_url: Optional[str] = None
+    pack_hash: Optional[str] = None
+    cached: bool = False
+    timings: Dict[str, float] = {}
+    context: Dict[str, int] = {}  # KB context packing: budget, tokens_in/out/saved, snippets_in/out, duplicates
+class GenerateUpdateRequest(BaseModel):
+    requirement_yaml: str  # the edited requirement; diffed against the one the session was generated from
+    stream_zip: bool = False
+class GenerateUpdateResponse(GenerateResponse):
+    changed: List[str] = []  # requirement keys that differ, as dotted paths
+    rerendered: List[str] = []  # artifacts whose templates read a changed key
+    revalidated: List[str] = []  # validation rules re-run
+class BatchGenerateRequest(BaseModel):
+    items: List[GenerateRequest]
+    combined_zip: bool = False  # also keep one ZIP with every pack under <nn>_<module>/
+class BatchItemResult(BaseModel):
+    index: int
+    ok: bool
+    module: str
+    session_id: Optional[str] = None
+    download_url: Optional[str] = None
+    files: List[str] = []
+    validation: Dict[str, Any] = {}
+    timings: Dict[str, float] = {}
+    cached: bool = False
+    context: Dict[str, int] = {}
+    error: Optional[str] = None
+class BatchGenerateResponse(BaseModel):
+    ok: bool
+    batch_id: str
+    items: List[BatchItemResult]
+    download_url: Optional[str] = None
+    timings: Dict[str, float] = {}
+class JobAccepted(BaseModel):
+    job_id: str
+    status_url: str
+    events_url: str
 
 app=FastAPI(title='WMS Design AI Agent — Orchestrator',version='0.3.0')
+app.add_middleware(MetricsMiddleware)
+
+# recent design packs kept as in-memory artifacts (by session id and by pack hash) so /download and
+# repeated identical requests are served without touching disk
+_sessions=OrderedDict()
+_packs=OrderedDict()
+_contexts=OrderedDict()  # session id -> inputs of its current pack (see _pack_ctx), for /generate/{id}/update
+_sessions_lock=threading.Lock()
+jobs=JobManager()
+
+def _remember(session_id,artifacts,key=None,ctx=None):
+    with _sessions_lock:
+        if ctx is not None:
+            _contexts[session_id]=ctx; _contexts.move_to_end(session_id)
+            while len(_contexts)>MEM_SESSIONS: _contexts.popitem(last=False)
+        if artifacts is None: return
+        _sessions[session_id]=artifacts
+        while len(_sessions)>MEM_SESSIONS: _sessions.popitem(last=False)
+        if key:
+            _packs[key]=artifacts; _packs.move_to_end(key)
+            while len(_packs)>MEM_SESSIONS: _packs.popitem(last=False)
+
+def _recall(session_id):
+    with _sessions_lock:
+        arts=_sessions.get(session_id)
+        if arts is not None: _sessions.move_to_end(session_id)
+        return arts
+
+def _session_artifacts(session_id):
+    arts=_recall(session_id)
+    if arts is not None: return arts
+    zp=_output_store().resolve(session_id)
+    if not zp: return None
+    with zipfile.ZipFile(zp) as z:
+        return {n:z.read(n).decode('utf-8') for n in z.namelist()}
+
+def _output_store():
+    return get_output_store(os.path.join(os.environ.get('WMS_OUT_DIR', os.path.join(os.getcwd(),'outputs')),'store'))
+
+def _zip_response(session_id,artifacts,headers=None):
+    h={'Content-Disposition':f'attachment; filename="designpack_{session_id}.zip"','X-Session-Id':session_id}
+    h.update(headers or {})
+    return StreamingResponse(stream_zip(artifacts),media_type='application/zip',headers=h)
+
+def _retriever(name):
+    # the vector/hybrid retrievers pull in requests and numpy: imported on first use or by the warm-up, not with the app
+    return importlib.import_module(f'orchestrator.{name}')
+
+# readiness: set once the startup warm-up has run, so a new instance only gets traffic when the first request is cheap
+_ready=threading.Event()
+_warmup={'steps':{},'errors':{}}
+
+def _warm_steps():
+    steps=[('templates',warm_templates),('yaml',lambda: importlib.import_module('yaml')),('llm_cache',get_llm_cache)]
+    if QDRANT_URL: steps.append(('qdrant',lambda: _retriever('retriever_qdrant')))
+    elif LOCAL_VECTOR_DIR: steps.append(('local_vector',lambda: _retriever('retriever_local').get_store()))
+    if RETRIEVAL_MODE=='hybrid': steps.append(('hybrid',lambda: _retriever('retriever_hybrid')))
+    if RETRIEVAL_MODE in ('lexical','hybrid') or not (QDRANT_URL or LOCAL_VECTOR_DIR): steps.append(('kb_index',lambda: kb_index(KB_DIR)))
+    providers=WARM_PROVIDERS or [p for p in ('openai','gemini') if LLMClient(p).available()]+(['ollama'] if os.environ.get('OLLAMA_URL') else [])
+    steps+=[(f'llm_{p}',LLMClient(p).warm) for p in providers]
+    steps.append(('tokenizer',lambda: [count_tokens('',LLMClient(p).model) for p in providers+['none']]))
+    return steps
+
+def _warm():
+    """Precompile templates, import the configured retrievers and build their index, open the LLM cache and warm
+    provider clients. A failing step is recorded in /readyz but does not keep the instance unready."""
+    t0=time.perf_counter()
+    for name,fn in _warm_steps():
+        t=time.perf_counter()
+        try: fn()
+        except Exception as e: _warmup['errors'][name]=str(e)
+        _warmup['steps'][f'{name}_ms']=_ms(t)
+    _warmup['steps']['total_ms']=_ms(t0)
+    _ready.set()
+
+@app.on_event('startup')
+def _startup():
+    if WARMUP=='off': _ready.set()
+    elif WARMUP=='blocking': _warm()
+    else: threading.Thread(target=_warm,name='warmup',daemon=True).start()
 
 @app.get('/healthz')
 def healthz(): return {'status':'ok'}
 
-@app.post('/ingest/url', response_model=IngestURLResponse)
-def ingest_url(req: IngestURLRequest):
-    dag_id='ingest_document'
+@app.get('/readyz')
+def readyz(response: Response):
+    ready=_ready.is_set()
+    if not ready: response.status_code=503
+    return {'status':'ready' if ready else 'warming','warmup':_warmup['steps'],'errors':_warmup['errors']}
+
+@app.get('/cache/llm')
+def llm_cache_stats(): return get_llm_cache().snapshot()
+
+@app.get('/llm/providers')
+def llm_providers(): return llm_guard_snapshot()
+
+@app.get('/metrics')
+def prometheus_metrics():
+    gauges={f'wms_jobs_{k}':v for k,v in jobs.stats().items()}
+    gauges['wms_ready']=int(_ready.is_set())
+    gauges.update((f'wms_llm_cache_{k}',v) for k,v in get_llm_cache().snapshot().items() if isinstance(v,(int,float)))
+    return PlainTextResponse(render_metrics(gauges),media_type=METRICS_CONTENT_TYPE)
+
+def _trigger_dag(dag_id,conf):
     run_id=f"manual__{uuid.uuid4().hex[:8]}"
-    payload={'dag_run_id':run_id,'conf':{'url':req.url,'module':req.module,'tags':req.tags}}
+    payload={'dag_run_id':run_id,'conf':conf}
+    import requests
     r=requests.post(f"{AIRFLOW_API_URL}/dags/{dag_id}/dagRuns",auth=(AIRFLOW_USERNAME,AIRFLOW_PASSWORD),json=payload,timeout=15)
     if not r.ok: raise HTTPException(500,f'Airflow API error: {r.text}')
+    return run_id
+
+@app.post('/ingest/url', response_model=IngestURLResponse)
+def ingest_url(req: IngestURLRequest):
+    run_id=_trigger_dag('ingest_document',{'url':req.url,'module':req.module,'tags':req.tags})
     return IngestURLResponse(ok=True, dag_run_id=run_id)
 
+@app.post('/ingest/bulk', response_model=IngestBulkResponse)
+def ingest_bulk(req: IngestBulkRequest):
+    """One `ingest_bulk` DAG run for many pages: fetch/chunk is mapped per host shard, upserts are merged."""
+    urls=list(OrderedDict.fromkeys(u.strip() for u in req.urls if u and u.strip()))
+    if not urls and not req.sitemap: raise HTTPException(400,'urls or sitemap required')
+    bad=[u for u in urls+([req.sitemap] if req.sitemap else []) if not u.lower().startswith(('http://','https://'))]
+    if bad: raise HTTPException(400,f'not an http(s) url: {bad[0]}')
+    conf={'urls':urls,'sitemap':req.sitemap,'module':req.module,'tags':req.tags}
+    if req.per_host: conf['per_host']=req.per_host
+    run_id=_trigger_dag('ingest_bulk',conf)
+    return IngestBulkResponse(ok=True, dag_run_id=run_id, urls=len(urls))
+
 @app.get('/download/{session_id}')
 def download(session_id:str):
+    arts=_recall(session_id)
+    if arts is not None: return _zip_response(session_id,arts)
+    zp=_output_store().resolve(session_id)
+    if zp: return FileResponse(zp, media_type='application/zip', filename=f'designpack_{session_id}.zip')
     base_out=os.environ.get('WMS_OUT_DIR', os.path.join(os.getcwd(),'outputs'))
     zp=os.path.join(base_out,f'out_{session_id}.zip')
     if not os.path.exists(zp): raise HTTPException(404,'ZIP not found')
     return FileResponse(zp, media_type='application/zip', filename=f'designpack_{session_id}.zip')
 
-@app.post('/generate', response_model=GenerateResponse)
-def generate(req: GenerateRequest):
+def _parse_requirement(text):
+    import yaml
     try:
-        data=yaml.safe_load(req.requirement_yaml)
+        with span('parse'):
+            data=yaml.safe_load(text)
         if not isinstance(data,dict): raise ValueError('Invalid YAML content')
     except Exception as e:
         raise HTTPException(400,f'YAML parse error: {e}')
-    session_id=str(uuid.uuid4())[:8]
-    base_out=os.environ.get('WMS_OUT_DIR', os.path.join(os.getcwd(),'outputs'))
-    os.makedirs(base_out,exist_ok=True)
-    out_dir=os.path.join(base_out,f'out_{session_id}')
-    os.makedirs(out_dir,exist_ok=True)
-
-    rag_ctx=''
-    if req.use_rag:
-        query=f"{req.module} WMS design "+' '.join([str(v) for v in data.values() if isinstance(v,(str,int,float))])
-        if QDRANT_URL:
-            rag_ctx=build_ctx_qdrant(query,k=6,filters={'module':req.module})
-        else:
-            kb_dir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..','kb'))
-            docs=load_kb_simple(kb_dir)
-            rag_ctx=build_ctx_simple(query,docs,k=4)
+    return data
+
+def _no_stage(name): return nullcontext()
+
+@contextmanager
+def _step(stage,name,timings,nested=True):
+    # job progress + a span recorded into this request's timings; `nested` also collects spans opened
+    # further down (LLM provider call, validators), which is only safe for blocks that do not yield
+    with stage(name), span(name,into=timings), (collect(timings) if nested else nullcontext()):
+        yield
+
+def _new_session(persist):
+    return str(uuid.uuid4())[:8],(PERSIST_OUTPUTS if persist is None else persist)
+
+def _rag_query(module,data):
+    return f"{module} WMS design "+' '.join([str(v) for v in data.values() if isinstance(v,(str,int,float))])
+
+def _payload_snippets(hits):
+    return [Snippet(f"{h.get('payload',{}).get('uri','')}#{h.get('payload',{}).get('chunk_index','?')}",
+                    h.get('payload',{}).get('text') or '',h.get('score',0.0)) for h in hits]
 
+def _retrieve(module,data,use_rag=True,mode=None):
+    """(ranked snippets, timings). 'auto' is Qdrant, else the local vector store, else BM25 over the KB;
+    'hybrid' runs BM25 and the vector retriever concurrently and fuses them (see retriever_hybrid)."""
+    if not use_rag: return [],{}
+    mode=(mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES: raise HTTPException(400,f'Unknown retrieval mode: {mode}')
+    query=_rag_query(module,data)
+    t0=time.perf_counter()
+    if mode=='hybrid':
+        hits,t=_retriever('retriever_hybrid').search(query,k=6,filters={'module':module},kb_dir=KB_DIR)
+        timings={f'rag_{n}':v for n,v in t.items() if n!='total_ms'}
+        timings['rag_ms']=t['total_ms']
+        snippets=[Snippet(os.path.basename(h['uri'])+('' if h['chunk_index'] is None else f"#{h['chunk_index']}"),h['text'],h['rrf'])
+                  for h in hits]
+        return snippets,timings
+    if mode=='vector' and not (QDRANT_URL or LOCAL_VECTOR_DIR):
+        raise HTTPException(400,'Vector retrieval needs QDRANT_URL or LOCAL_VECTOR_DIR')
+    if mode in ('auto','vector') and QDRANT_URL:
+        with span('qdrant'): snippets=_payload_snippets(_retriever('retriever_qdrant').search(query,k=6,filters={'module':module}))
+    elif mode in ('auto','vector') and LOCAL_VECTOR_DIR:
+        with span('local_vector'): snippets=_payload_snippets(_retriever('retriever_local').search(query,k=6,filters={'module':module}))
+    else:
+        with span('kb'): index=kb_index(KB_DIR)
+        with span('bm25'): snippets=[Snippet(os.path.basename(path),text,score) for path,text,score in index.search(query,k=4)]
+    return snippets,{'rag_ms':_ms(t0)}
+
+def _pack_snippets(req,data,snippets):
+    """(context text, packing stats): retrieved snippets deduplicated and fitted to the token budget of the
+    request's provider/model (or its context_budget)."""
+    if not snippets: return '',{}
     llm=LLMClient(req.llm_provider, req.llm_model)
+    budget=context_budget(llm.provider,llm.model) if req.context_budget is None else req.context_budget
+    with span('pack'):
+        return pack_context(_rag_query(req.module,data),snippets,budget,llm.model)
+
+def _assumption_prompts(requirement_yaml,rag_ctx):
+    sys='You are a WMS solution architect. Write crisp assumptions & gaps given requirement and KB snippets.'
+    user=f"Requirement:\n{requirement_yaml}\n\nKB snippets:\n{rag_ctx}"
+    return sys,user
+
+def _render_extra(rag_ctx,assumptions):
+    return {'rag_snippets':rag_ctx,'assumptions_md':assumptions or 'Assumptions auto-generated not available; please review.'}
+
+def _ctx_key(ctx):
+    return pack_key(ctx['data'],ctx['module'],ctx['provider'],ctx['model'],ctx['rag_ctx'],ctx.get('fallback',False))
+
+def _pack_ctx(req,data,rag_ctx,persist):
+    """Everything a pack is derived from apart from the LLM assumptions (those stay in its assumptions.md),
+    plus its content hash under 'key'."""
+    llm=LLMClient(req.llm_provider, req.llm_model)
+    provider,model=(llm.provider,llm.model) if llm.available() else ('none','none')
+    ctx={'module':req.module,'data':data,'rag_ctx':rag_ctx,'provider':provider,'model':model,'persist':persist}
+    ctx['key']=_ctx_key(ctx)
+    return ctx
+
+def _fallback_ctx(ctx):
+    # assumptions came from LLM fallback text: keep the pack under a key of its own, so identical requests made
+    # once the provider answers again are not served this one
+    ctx=dict(ctx,fallback=True)
+    ctx['key']=_ctx_key(ctx)
+    return ctx
+
+def _lookup(session_id,key,persist,ctx=None):
+    """An existing pack for this content hash as (artifacts or None, meta), or None. Binds session_id to it."""
+    with _sessions_lock:
+        arts=_packs.get(key)
+    if arts is not None:
+        _remember(session_id,arts,key,ctx)
+        meta=_output_store().get(key) if persist else None
+        if persist and meta is None: meta=_output_store().put(key,arts,json.loads(arts['validation_report.json']))
+        if meta: _output_store().link(session_id,key)
+        return arts,meta or {'files':list(arts),'validation':json.loads(arts['validation_report.json'])}
+    if persist:
+        meta=_output_store().get(key)
+        if meta:
+            _output_store().link(session_id,key); _remember(session_id,None,ctx=ctx)
+            return None,meta
+    return None
+
+def _store(session_id,key,artifacts,validation,persist,ctx=None,base=None,changed=None):
+    """Keep the pack for /download; when persisting also put its ZIP in the pack store (patched from the `base`
+    pack's ZIP when given, see OutputStore.put). Returns the ZIP path, if any."""
+    _remember(session_id,artifacts,key,ctx)
+    if not persist: return None
+    meta=_output_store().put(key,artifacts,validation,base,changed)
+    _output_store().link(session_id,key)
+    return meta['zip_path']
+
+def _response(session_id,key,files,validation,zip_path=None,cached=False,timings=None,context=None):
+    return GenerateResponse(ok=True,out_dir=os.path.dirname(zip_path) if zip_path else None,zip_path=zip_path,files=files,
+                            validation=validation,session_id=session_id,download_url=f'/download/{session_id}',pack_hash=key,cached=cached,
+                            timings=timings or {},context=context or {})
+
+def _pipeline(req,data,stage=_no_stage,stream=False,timings=None):
+    """The generate pipeline as a generator of (kind, value): ('token', text) while streaming the LLM,
+    then a final ('result', (GenerateResponse, artifacts)). `stage(name)` wraps each stage for progress reporting;
+    per-stage milliseconds are added to `timings` and returned in GenerateResponse.timings."""
+    timings={} if timings is None else timings
+    t0=time.perf_counter()
+    session_id,persist=_new_session(req.persist)
+
+    with _step(stage,'rag',timings):
+        snippets,rag_timings=_retrieve(req.module,data,req.use_rag,req.retrieval)
+        rag_ctx,context=_pack_snippets(req,data,snippets)
+    rag_timings.pop('rag_ms',None); timings.update(rag_timings)
+    ctx=_pack_ctx(req,data,rag_ctx,persist); key=ctx['key']
+    hit=_lookup(session_id,key,persist,ctx)
+    if hit:
+        arts,meta=hit
+        timings['total_ms']=_ms(t0)
+        yield 'result',(_response(session_id,key,meta['files'],meta['validation'],meta.get('zip_path'),cached=True,timings=timings,context=context),arts)
+        return
+
     assumptions=''
-    if llm.available():
-        sys='You are a WMS solution architect. Write crisp assumptions & gaps given requirement and KB snippets.'
-        user=f"Requirement:\n{req.requirement_yaml}\n\nKB snippets:\n{rag_ctx}"
-        assumptions=llm.complete(sys,user,max_tokens=400).strip()
-
-    files=render_designpack(req.module,data,out_dir,extra={'rag_snippets':rag_ctx,'assumptions_md':assumptions or 'Assumptions auto-generated not available; please review.'})
-
-    openapi_path=os.path.join(out_dir,f'openapi_{req.module.lower()}.json')
-    erd_path=os.path.join(out_dir,f'erd_{req.module.lower()}.mmd')
-    nfr_path=os.path.join(out_dir,'nfr.md')
-    dep_path=os.path.join(out_dir,'deployment.mmd')
-    validation={'openapi':[], 'erd_api':[], 'nfr_deployment':[]}
-    validation['openapi']=validate_openapi(openapi_path)
-    validation['erd_api']=check_api_vs_erd(openapi_path, erd_path)
-    validation['nfr_deployment']=check_nfr_vs_deployment(nfr_path, dep_path)
-    with open(os.path.join(out_dir,'validation_report.json'),'w') as f:
-        json.dump(validation,f,indent=2)
-    files.append('validation_report.json')
-
-    zip_path=export_zip(out_dir)
-    return GenerateResponse(ok=True,out_dir=out_dir,zip_path=zip_path,files=files,validation=validation,session_id=session_id,download_url=f'/download/{session_id}')
+    with _step(stage,'llm',timings,nested=not stream):
+        llm=LLMClient(req.llm_provider, req.llm_model)
+        if llm.available():
+            sys,user=_assumption_prompts(req.requirement_yaml,rag_ctx)
+            if stream:
+                parts=[]
+                for piece in llm.stream_complete(sys,user,max_tokens=400):
+                    parts.append(piece); yield 'token',piece
+                assumptions=''.join(parts).strip()
+            else:
+                assumptions=llm.complete(sys,user,max_tokens=400).strip()
+            if llm.fell_back:
+                ctx=_fallback_ctx(ctx); key=ctx['key']
+
+    with _step(stage,'render',timings):
+        artifacts=render_artifacts(req.module,data,extra=_render_extra(rag_ctx,assumptions))
+    with _step(stage,'validate',timings):
+        validation=validate_artifacts(req.module,artifacts)
+        artifacts['validation_report.json']=json.dumps(validation,indent=2)
+
+    with _step(stage,'zip',timings):
+        zip_path=_store(session_id,key,artifacts,validation,persist,ctx)
+    timings['total_ms']=_ms(t0)
+    yield 'result',(_response(session_id,key,list(artifacts),validation,zip_path,timings=timings,context=context),artifacts)
+
+def _run_generate(req,data,stage=_no_stage,timings=None):
+    for kind,val in _pipeline(req,data,stage,timings=timings):
+        if kind=='result': return val
+
+def _ndjson(events):
+    try:
+        for kind,val in events:
+            msg={'event':'token','text':val} if kind=='token' else {'event':'result',**val[0].dict()}
+            yield json.dumps(msg)+'\n'
+    except Exception as e:
+        yield json.dumps({'event':'error','detail':getattr(e,'detail',None) or str(e)})+'\n'
+
+@app.post('/generate', response_model=GenerateResponse)
+def generate(req: GenerateRequest, response: Response):
+    with collect() as timings:
+        data=_parse_requirement(req.requirement_yaml)
+    if req.stream_assumptions:
+        return StreamingResponse(_ndjson(_pipeline(req,data,stream=True,timings=timings)),media_type='application/x-ndjson')
+    resp,artifacts=_run_generate(req,data,timings=timings)
+    headers={'Server-Timing':server_timing(resp.timings)}
+    if req.stream_zip:
+        if artifacts is None:
+            return FileResponse(resp.zip_path, media_type='application/zip', filename=f'designpack_{resp.session_id}.zip', headers=headers)
+        return _zip_response(resp.session_id,artifacts,headers)
+    response.headers.update(headers)
+    return resp
+
+def _ms(t0): return round((time.perf_counter()-t0)*1000,1)
+
+def _diff_paths(old,new,prefix=()):
+    """Key paths where two parsed requirements differ; mappings are compared key by key, anything else as a whole."""
+    if not (isinstance(old,dict) and isinstance(new,dict)):
+        return [] if old==new else [prefix]
+    out=[]
+    for k in dict.fromkeys(list(old)+list(new)):
+        if k in old and k in new: out+=_diff_paths(old[k],new[k],prefix+(k,))
+        else: out.append(prefix+(k,))
+    return out
+
+@app.post('/generate/{session_id}/update', response_model=GenerateUpdateResponse)
+def generate_update(session_id:str, req: GenerateUpdateRequest, response: Response):
+    """Re-derive a session's pack from an edited requirement: only artifacts whose templates read a changed key are
+    re-rendered, only the rules reading those artifacts re-run, and a persisted ZIP is patched. Retrieval context
+    and LLM assumptions are kept from the session's last generation."""
+    with collect() as timings:
+        data=_parse_requirement(req.requirement_yaml)
+    t0=time.perf_counter()
+    with _sessions_lock:
+        ctx=_contexts.get(session_id)
+    base=_session_artifacts(session_id) if ctx else None
+    if base is None: raise HTTPException(404,'No generated pack for this session in memory; call /generate first')
+    module=ctx['module']
+    with span('diff',into=timings):
+        changed=_diff_paths(ctx['data'],data)
+        files=affected_artifacts(module,changed)
+    new=dict(ctx,data=data)
+    key=new['key']=_ctx_key(new)
+    hit=_lookup(session_id,key,ctx['persist'],new)
+    rules=[]
+    if hit:
+        arts,meta=hit
+        files,validation,zip_path=meta['files'],meta['validation'],meta.get('zip_path')
+    else:
+        with span('render',into=timings):
+            fresh=render_artifacts(module,data,extra=_render_extra(ctx['rag_ctx'],base.get('assumptions.md')),only=files) if files else {}
+        patched=[n for n,c in fresh.items() if base.get(n)!=c]
+        arts=dict(base); arts.update((n,fresh[n]) for n in patched)
+        rules=rules_for(module,patched)
+        validation=json.loads(base['validation_report.json'])
+        with span('validate',into=timings), collect(timings):
+            validation.update(validate_artifacts(module,arts,rules))
+        report=json.dumps(validation,indent=2)
+        if report!=base['validation_report.json']:
+            arts['validation_report.json']=report; patched.append('validation_report.json')
+        with span('zip',into=timings):
+            zip_path=_store(session_id,key,arts,validation,ctx['persist'],new,base=ctx['key'],changed=patched)
+    timings['total_ms']=_ms(t0)
+    resp=GenerateUpdateResponse(**_response(session_id,key,list(arts) if arts else files,validation,zip_path,bool(hit),timings).dict(),
+                                changed=['.'.join(map(str,p)) for p in changed],rerendered=[] if hit else list(fresh),revalidated=rules)
+    headers={'Server-Timing':server_timing(resp.timings)}
+    if req.stream_zip:
+        if arts is None:
+            return FileResponse(resp.zip_path, media_type='application/zip', filename=f'designpack_{session_id}.zip', headers=headers)
+        return _zip_response(session_id,arts,headers)
+    response.headers.update(headers)
+    return resp
+
+@app.post('/generate/batch', response_model=BatchGenerateResponse)
+def generate_batch(req: BatchGenerateRequest):
+    if not req.items: raise HTTPException(400,'No items')
+    if len(req.items)>BATCH_MAX_ITEMS: raise HTTPException(413,f'At most {BATCH_MAX_ITEMS} items per batch')
+    t_batch=time.perf_counter()
+    results=[BatchItemResult(index=i,ok=False,module=it.module) for i,it in enumerate(req.items)]
+
+    # parse each distinct YAML once
+    parsed={}
+    for it,res in zip(req.items,results):
+        if it.requirement_yaml not in parsed:
+            t0=time.perf_counter()
+            try: parsed[it.requirement_yaml]=(_parse_requirement(it.requirement_yaml),None)
+            except HTTPException as e: parsed[it.requirement_yaml]=(None,e.detail)
+            res.timings['parse_ms']=_ms(t0)
+        if parsed[it.requirement_yaml][1]: res.error=parsed[it.requirement_yaml][1]
+    live=[i for i,r in enumerate(results) if r.error is None]
+
+    def timed(fn,*args):
+        t0=time.perf_counter()
+        try: return fn(*args),None,_ms(t0)
+        except Exception as e: return None,getattr(e,'detail',None) or str(e),_ms(t0)
+
+    def assume(it,rag_ctx):
+        llm=LLMClient(it.llm_provider, it.llm_model)
+        if not llm.available(): return '',False
+        return llm.complete(*_assumption_prompts(it.requirement_yaml,rag_ctx),max_tokens=400).strip(),llm.fell_back
+
+    with ThreadPoolExecutor(max_workers=min(8,len(live) or 1),thread_name_prefix='batch') as tp:
+        # retrieve once per distinct query, concurrently
+        rag_keys={i:(req.items[i].module,req.items[i].requirement_yaml,req.items[i].use_rag,req.items[i].retrieval) for i in live}
+        rag_futs={key:tp.submit(timed,_retrieve,key[0],parsed[key[1]][0],key[2],key[3]) for key in set(rag_keys.values())}
+        rag={key:f.result() for key,f in rag_futs.items()}
+        ctxs={}
+        for i in live:
+            out,err,ms=rag[rag_keys[i]]
+            results[i].timings.update(out[1] if out else {'rag_ms':ms})
+            if err: results[i].error=f'rag: {err}'; continue
+            # packed per item: the token budget depends on the item's provider/model
+            it=req.items[i]
+            ctxs[i],results[i].context=_pack_snippets(it,parsed[it.requirement_yaml][0],out[0])
+        live=[i for i in live if results[i].error is None]
+        # identical packs already produced are reused as-is
+        sessions,packs,hits={},{},{}
+        for i in live:
+            it=req.items[i]
+            sessions[i]=_new_session(it.persist)
+            packs[i]=_pack_ctx(it,parsed[it.requirement_yaml][0],ctxs[i],sessions[i][1])
+            hit=_lookup(sessions[i][0],packs[i]['key'],sessions[i][1],packs[i])
+            if hit: hits[i]=hit
+        live=[i for i in live if i not in hits]
+        # LLM calls are I/O bound; identical prompts are coalesced by the LLM cache
+        llm_futs={i:tp.submit(timed,assume,req.items[i],ctxs[i]) for i in live}
+        assumptions={}
+        for i,f in llm_futs.items():
+            out,err,results[i].timings['llm_ms']=f.result()
+            if err: results[i].error=f'llm: {err}'; continue
+            assumptions[i],fell_back=out
+            if fell_back: packs[i]=_fallback_ctx(packs[i])
+    live=[i for i in live if results[i].error is None]
+
+    # CPU-bound render + validate fans out across processes
+    pool=batch_pool() if live else None
+    futs={i:pool.submit(render_and_validate,req.items[i].module,parsed[req.items[i].requirement_yaml][0],
+                        _render_extra(ctxs[i],assumptions[i])) for i in live}
+    combined={}
+    for i in sorted(set(futs)|set(hits)):
+        res=results[i]
+        session_id,persist=sessions[i]
+        if i in hits:
+            artifacts,meta=hits[i]
+            validation=meta['validation']; res.cached=True
+            if artifacts is None and req.combined_zip:
+                with zipfile.ZipFile(meta['zip_path']) as z:
+                    artifacts={n:z.read(n).decode('utf-8') for n in z.namelist()}
+            files=meta['files']
+        else:
+            try:
+                artifacts,validation,timings=futs[i].result()
+            except Exception as e:
+                res.error=f'render: {e}'; continue
+            _store(session_id,packs[i]['key'],artifacts,validation,persist,packs[i])
+            res.timings.update(timings)
+            files=list(artifacts)
+        res.ok=True; res.session_id=session_id; res.download_url=f'/download/{session_id}'
+        res.files=files; res.validation=validation
+        if req.combined_zip:
+            prefix=f"{i:02d}_{res.module.lower()}/"
+            combined.update((prefix+name,content) for name,content in artifacts.items())
+
+    batch_id=uuid.uuid4().hex[:8]
+    download_url=None
+    if combined:
+        _remember(batch_id,combined); download_url=f'/download/{batch_id}'
+    return BatchGenerateResponse(ok=all(r.ok for r in results),batch_id=batch_id,items=results,download_url=download_url,
+                                 timings={'total_ms':_ms(t_batch),'workers':float(BATCH_WORKERS)})
+
+@app.post('/jobs/generate', response_model=JobAccepted, status_code=202)
+def submit_generate(req: GenerateRequest):
+    with collect() as timings:
+        data=_parse_requirement(req.requirement_yaml)
+    try:
+        job=jobs.submit('generate',lambda job: _run_generate(req,data,stage=job.stage,timings=timings)[0].dict())
+    except QueueFull as e:
+        raise HTTPException(429,f'Generate queue is full ({e}); retry later',headers={'Retry-After':'5'})
+    return JobAccepted(job_id=job.id,status_url=f'/jobs/{job.id}',events_url=f'/jobs/{job.id}/events')
+
+@app.get('/jobs/{job_id}')
+def job_status(job_id:str):
+    job=jobs.get(job_id)
+    if job is None: raise HTTPException(404,'Job not found')
+    return job.snapshot()
+
+@app.get('/jobs/{job_id}/events')
+async def job_events(job_id:str):
+    job=jobs.get(job_id)
+    if job is None: raise HTTPException(404,'Job not found')
+    async def sse():
+        seen=0
+        while True:
+            batch=job.events[seen:]
+            for ev in batch:
+                yield f"event: {ev['event']}\ndata: {json.dumps(ev)}\n\n"
+            seen+=len(batch)
+            if job.finished and seen>=len(job.events): break
+            await job.wait(seen)
+    return StreamingResponse(sse(),media_type='text/event-stream',headers={'Cache-Control':'no-cache'})
@@ -0,0 +1,130 @@
+import os,time,bisect,functools,threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+METRICS=os.environ.get('WMS_METRICS','1').lower() not in ('0','false','no')
+BUCKETS=(0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0)
+CONTENT_TYPE='text/plain; version=0.0.4'  # PlainTextResponse appends the charset
+
+# Process-local registry in Prometheus text format. Every update is a dict lookup plus a few additions under
+# one lock, so spans are cheap enough to wrap every stage of every request.
+_lock=threading.Lock()
+_hist={}      # (name, labels) -> [per-bucket counts (+Inf last), sum]
+_counters={}  # (name, labels) -> value
+_gauges={}    # (name, labels) -> value
+_timings=ContextVar('wms_timings',default=None)
+
+def _key(name,labels):
+    return name,tuple(sorted(labels.items()))
+
+def observe(name,seconds,**labels):
+    if not METRICS: return
+    k=_key(name,labels); i=bisect.bisect_left(BUCKETS,seconds)
+    with _lock:
+        h=_hist.get(k)
+        if h is None: h=_hist[k]=[[0]*(len(BUCKETS)+1),0.0]
+        h[0][i]+=1; h[1]+=seconds
+
+def inc(name,n=1,**labels):
+    if not METRICS: return
+    k=_key(name,labels)
+    with _lock: _counters[k]=_counters.get(k,0)+n
+
+def gauge_add(name,delta,**labels):
+    if not METRICS: return
+    k=_key(name,labels)
+    with _lock: _gauges[k]=_gauges.get(k,0)+delta
+
+@contextmanager
+def collect(into=None):
+    """Make `into` (or a new dict) the timings sink for spans opened below this point in the current context.
+    Do not hold it across a generator's yield: contexts are not preserved between resumes."""
+    t={} if into is None else into
+    tok=_timings.set(t)
+    try: yield t
+    finally: _timings.reset(tok)
+
+@contextmanager
+def span(name,into=None,**labels):
+    """Time a block: wms_span_seconds{span=name,...} histogram, wms_span_inflight gauge, wms_span_errors_total
+    on exceptions, and '<name>[_<label values>]_ms' added to `into` or the collecting timings dict."""
+    t0=time.perf_counter()
+    gauge_add('wms_span_inflight',1,span=name)
+    failed=False
+    try:
+        yield
+    except BaseException:
+        failed=True; raise
+    finally:
+        dt=time.perf_counter()-t0
+        gauge_add('wms_span_inflight',-1,span=name)
+        observe('wms_span_seconds',dt,span=name,**labels)
+        if failed: inc('wms_span_errors_total',span=name,**labels)
+        t=into if into is not None else _timings.get()
+        if t is not None:
+            key='_'.join([name,*map(str,labels.values())])+'_ms'
+            t[key]=round(t.get(key,0.0)+dt*1000,1)
+
+def timed(name,**labels):
+    """Decorator form of span()."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*a,**kw):
+            with span(name,**labels): return fn(*a,**kw)
+        return wrapper
+    return deco
+
+def server_timing(timings):
+    """Server-Timing header value for a timings dict ('<name>_ms' entries)."""
+    return ', '.join(f"{k[:-3]};dur={v}" for k,v in timings.items() if k.endswith('_ms'))
+
+def _fmt(labels,extra=()):
+    items=list(labels)+list(extra)
+    if not items: return ''
+    esc=lambda v: str(v).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+    return '{'+','.join(f'{k}="{esc(v)}"' for k,v in items)+'}'
+
+def render(gauges=None):
+    """Everything recorded so far in the Prometheus text exposition format, plus ad-hoc `gauges` {name: value}."""
+    with _lock:
+        hist={k:(list(v[0]),v[1]) for k,v in _hist.items()}
+        counters=dict(_counters); gs=dict(_gauges)
+    out=[]
+    def block(kind,data):
+        typed=set()
+        for (name,labels),val in sorted(data.items()):
+            if name not in typed: out.append(f'# TYPE {name} {kind}'); typed.add(name)
+            if kind!='histogram':
+                out.append(f'{name}{_fmt(labels)} {val}'); continue
+            counts,total=val; acc=0
+            for le,c in zip(BUCKETS+('+Inf',),counts):
+                acc+=c; out.append(f'{name}_bucket{_fmt(labels,[("le",le)])} {acc}')
+            out.append(f'{name}_sum{_fmt(labels)} {round(total,6)}')
+            out.append(f'{name}_count{_fmt(labels)} {acc}')
+    block('histogram',hist); block('counter',counters)
+    gs.update(((name,()),val) for name,val in (gauges or {}).items())
+    block('gauge',gs)
+    return '\n'.join(out)+'\n'
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency histogram and count per handler/method/status, plus an in-flight gauge."""
+
+    def __init__(self,app):
+        self.app=app
+
+    async def __call__(self,scope,receive,send):
+        if scope['type']!='http' or not METRICS:
+            await self.app(scope,receive,send); return
+        t0=time.perf_counter(); status=[500]
+        async def send_status(msg):
+            if msg['type']=='http.response.start': status[0]=msg['status']
+            await send(msg)
+        gauge_add('wms_http_inflight',1)
+        try:
+            await self.app(scope,receive,send_status)
+        finally:
+            gauge_add('wms_http_inflight',-1)
+            # the router fills scope['endpoint'] in place, so label by handler rather than raw path
+            handler=getattr(scope.get('endpoint'),'__name__','unmatched')
+            observe('wms_http_request_seconds',time.perf_counter()-t0,handler=handler,method=scope['method'])
+            inc('wms_http_requests_total',handler=handler,method=scope['method'],status=status[0])
@@ -0,0 +1,109 @@
+import os,json,time,shutil,sqlite3,hashlib,threading
+from orchestrator.tools.exporter import write_zip, patch_zip
+from orchestrator.tools.render import template_fingerprint
+
+WMS_STORE_MAX_MB=float(os.environ.get('WMS_STORE_MAX_MB','1024'))
+WMS_STORE_MAX_AGE_DAYS=float(os.environ.get('WMS_STORE_MAX_AGE_DAYS','30'))
+
+def pack_key(requirement,module,provider,model,rag_ctx,fallback=False):
+    """Content hash of everything that determines a design pack's output, including the template sources.
+    `fallback` marks a pack whose assumptions are LLM fallback text: it gets its own key, so a request never
+    reuses it in place of a real answer."""
+    norm=json.dumps([requirement,module.lower(),provider,model,rag_ctx,bool(fallback),template_fingerprint()],
+                    sort_keys=True,separators=(',',':'),default=str)
+    return hashlib.sha256(norm.encode('utf-8')).hexdigest()
+
+class OutputStore:
+    """Content-addressed pack store: <root>/<h[:2]>/<h[2:4]>/<h>/pack.zip plus a SQLite index
+    (pack hash -> size/timestamps/files/validation, session id -> pack hash). Evicts by age, then LRU by size."""
+
+    def __init__(self,root,max_bytes=None,max_age=None):
+        self.root=root
+        self.max_bytes=int(WMS_STORE_MAX_MB*1024*1024) if max_bytes is None else max_bytes
+        self.max_age=WMS_STORE_MAX_AGE_DAYS*86400 if max_age is None else max_age
+        os.makedirs(root,exist_ok=True)
+        self._lock=threading.Lock()
+        self._db=sqlite3.connect(os.path.join(root,'index.sqlite'),check_same_thread=False,timeout=10)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS packs (hash TEXT PRIMARY KEY, size INTEGER, created REAL, accessed REAL, files TEXT, validation TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, hash TEXT, created REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS packs_accessed ON packs(accessed)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS sessions_hash ON sessions(hash)')
+        self._db.commit()
+
+    def _dir(self,h): return os.path.join(self.root,h[:2],h[2:4],h)
+    def zip_path(self,h): return os.path.join(self._dir(h),'pack.zip')
+
+    def get(self,h):
+        """Pack metadata {hash, zip_path, files, validation} if present and fresh; refreshes its LRU position."""
+        now=time.time()
+        with self._lock:
+            row=self._db.execute('SELECT created, files, validation FROM packs WHERE hash=?',(h,)).fetchone()
+            if row is None: return None
+            if (self.max_age>0 and now-row[0]>self.max_age) or not os.path.exists(self.zip_path(h)):
+                self._drop(h); self._db.commit(); return None
+            self._db.execute('UPDATE packs SET accessed=? WHERE hash=?',(now,h)); self._db.commit()
+        return {'hash':h,'zip_path':self.zip_path(h),'files':json.loads(row[1]),'validation':json.loads(row[2])}
+
+    def put(self,h,artifacts,validation,base=None,changed=None):
+        """Store a pack. With `base` (hash of a stored pack) and `changed` (names that differ from it), the ZIP is
+        patched from the base pack's ZIP instead of being built from scratch."""
+        d=self._dir(h); os.makedirs(d,exist_ok=True)
+        tmp=os.path.join(d,f'pack.zip.{os.getpid()}.{threading.get_ident()}.tmp')
+        src=self.get(base) if base and changed is not None else None
+        if src: patch_zip(src['zip_path'],tmp,{n:artifacts[n] for n in changed})
+        else: write_zip(tmp,artifacts)
+        os.replace(tmp,self.zip_path(h))
+        now=time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO packs VALUES (?,?,?,?,?,?)',
+                             (h,os.path.getsize(self.zip_path(h)),now,now,json.dumps(list(artifacts)),json.dumps(validation)))
+            self._evict(now,keep=h)
+            self._db.commit()
+        return {'hash':h,'zip_path':self.zip_path(h),'files':list(artifacts),'validation':validation}
+
+    def link(self,session_id,h):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO sessions VALUES (?,?,?)',(session_id,h,time.time())); self._db.commit()
+
+    def resolve(self,session_id):
+        """ZIP path for a session id, or None if unknown/evicted."""
+        with self._lock:
+            row=self._db.execute('SELECT hash FROM sessions WHERE session_id=?',(session_id,)).fetchone()
+        if row is None: return None
+        meta=self.get(row[0])
+        return meta['zip_path'] if meta else None
+
+    def _drop(self,h):
+        shutil.rmtree(self._dir(h),ignore_errors=True)
+        self._db.execute('DELETE FROM packs WHERE hash=?',(h,))
+        self._db.execute('DELETE FROM sessions WHERE hash=?',(h,))
+
+    def _evict(self,now,keep=None):
+        if self.max_age>0:
+            for (h,) in self._db.execute('SELECT hash FROM packs WHERE created<?',(now-self.max_age,)).fetchall():
+                if h!=keep: self._drop(h)
+        total=self._db.execute('SELECT COALESCE(SUM(size),0) FROM packs').fetchone()[0]
+        if total<=self.max_bytes: return
+        for h,size in self._db.execute('SELECT hash, size FROM packs ORDER BY accessed').fetchall():
+            if total<=self.max_bytes: break
+            if h==keep: continue
+            self._drop(h); total-=size
+
+    def stats(self):
+        with self._lock:
+            n,size=self._db.execute('SELECT COUNT(*), COALESCE(SUM(size),0) FROM packs').fetchone()
+            sessions=self._db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        return {'packs':n,'bytes':size,'sessions':sessions,'max_bytes':self.max_bytes,'max_age_s':self.max_age}
+
+_stores={}
+_stores_lock=threading.Lock()
+
+def get_store(root):
+    root=os.path.abspath(root)
+    s=_stores.get(root)
+    if s is None:
+        with _stores_lock:
+            s=_stores.get(root)
+            if s is None: s=_stores[root]=OutputStore(root)
+    return s
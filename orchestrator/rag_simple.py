@@ -1,7 +1,11 @@
-
-import os, re, math
+import os, re, math, time, heapq, hashlib, threading
 from collections import Counter
+from orchestrator.context_packer import Snippet, pack, CONTEXT_TOKEN_BUDGET
 TOKEN_RE = re.compile(r"[A-Za-z0-9_]+")
+KB_EXTS = (".md",".txt",".rst")
+CHUNK_CHARS = int(os.environ.get("KB_CHUNK_CHARS", "800"))
+REFRESH_SEC = float(os.environ.get("KB_REFRESH_SEC", "5"))
+BM25_K1, BM25_B = 1.2, 0.75
 
 def _tokenize(text: str):
     return [t.lower() for t in TOKEN_RE.findall(text)]
@@ -9,7 +13,6 @@ def _tokenize(text: str):
 def _vec(text: str):
     toks = _tokenize(text)
     c = Counter(toks)
-    import math
     norm = math.sqrt(sum(v*v for v in c.values())) or 1.0
     return c, norm
 
@@ -18,18 +21,140 @@ def _cosine(c1, n1, c2, n2):
     dot = sum(c1[k]*c2[k] for k in common)
     return dot/(n1*n2) if n1*n2 else 0.0
 
-def load_kb(kb_dir: str):
-    docs = []
+def _iter_kb_files(kb_dir: str):
     for root, _, files in os.walk(kb_dir):
         for f in files:
-            if f.endswith((".md",".txt",".rst")):
-                p = os.path.join(root, f)
-                try:
-                    docs.append((p, open(p, "r", encoding="utf-8").read()))
-                except: pass
+            if f.endswith(KB_EXTS):
+                yield os.path.join(root, f)
+
+def load_kb(kb_dir: str):
+    docs = []
+    for p in _iter_kb_files(kb_dir):
+        try:
+            with open(p, "r", encoding="utf-8") as fh:
+                docs.append((p, fh.read()))
+        except: pass
     return docs
 
+def _chunk(text: str, size: int = CHUNK_CHARS):
+    # paragraph-aligned chunks so a snippet never starts mid-sentence
+    out, cur = [], ""
+    for para in re.split(r"\n\s*\n", text):
+        para = para.strip()
+        if not para: continue
+        if cur and len(cur) + len(para) + 2 > size:
+            out.append(cur); cur = ""
+        while len(para) > size:
+            out.append(para[:size]); para = para[size:]
+        cur = f"{cur}\n\n{para}" if cur else para
+    if cur: out.append(cur)
+    return out
+
+class KBIndex:
+    """Chunk-level BM25 inverted index over a KB directory, refreshed incrementally by mtime/hash."""
+
+    def __init__(self, kb_dir: str):
+        self.kb_dir = kb_dir
+        self._lock = threading.Lock()
+        self._files = {}     # path -> (mtime, size, sha1, [chunk ids])
+        self._chunks = {}    # chunk id -> (path, text, length, Counter)
+        self._postings = {}  # term -> {chunk id: tf}
+        self._next_id = 0
+        self._checked = 0.0
+        self._snapshot = ({}, {})  # (term -> [(chunk id, bm25 weight)], chunk id -> (path, text))
+
+    def __len__(self):
+        return len(self._snapshot[1])
+
+    def _add_file(self, path, text):
+        ids = []
+        for piece in _chunk(text):
+            cid = self._next_id; self._next_id += 1
+            tf = Counter(_tokenize(piece))
+            self._chunks[cid] = (path, piece, sum(tf.values()), tf)
+            for term, n in tf.items():
+                self._postings.setdefault(term, {})[cid] = n
+            ids.append(cid)
+        return ids
+
+    def _drop_file(self, path):
+        for cid in self._files.pop(path, (0, 0, "", []))[3]:
+            _, _, _, tf = self._chunks.pop(cid)
+            for term in tf:
+                plist = self._postings.get(term)
+                if plist is None: continue
+                plist.pop(cid, None)
+                if not plist: del self._postings[term]
+
+    def _reweight(self):
+        n = len(self._chunks)
+        avg = (sum(c[2] for c in self._chunks.values()) / n) if n else 1.0
+        norms = {cid: BM25_K1 * (1 - BM25_B + BM25_B * c[2] / (avg or 1.0)) for cid, c in self._chunks.items()}
+        weights = {}
+        for term, plist in self._postings.items():
+            idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            weights[term] = [(cid, idf * tf * (BM25_K1 + 1) / (tf + norms[cid])) for cid, tf in plist.items()]
+        self._snapshot = (weights, {cid: (c[0], c[1]) for cid, c in self._chunks.items()})
+
+    def refresh(self, force: bool = False) -> bool:
+        """Re-stat the KB and re-index only added/changed/removed files. Returns True if the index changed."""
+        if not force and time.monotonic() - self._checked < REFRESH_SEC:
+            return False
+        with self._lock:
+            seen, changed = set(), False
+            for p in _iter_kb_files(self.kb_dir):
+                seen.add(p)
+                try:
+                    st = os.stat(p)
+                    old = self._files.get(p)
+                    if old and old[0] == st.st_mtime and old[1] == st.st_size:
+                        continue
+                    with open(p, "rb") as fh:
+                        raw = fh.read()
+                except OSError:
+                    continue
+                digest = hashlib.sha1(raw).hexdigest()
+                if old and old[2] == digest:
+                    self._files[p] = (st.st_mtime, st.st_size, digest, old[3]); continue
+                self._drop_file(p)
+                ids = self._add_file(p, raw.decode("utf-8", errors="ignore"))
+                self._files[p] = (st.st_mtime, st.st_size, digest, ids)
+                changed = True
+            for p in set(self._files) - seen:
+                self._drop_file(p); changed = True
+            if changed or force:
+                self._reweight()
+            self._checked = time.monotonic()
+            return changed
+
+    def search(self, query: str, k: int = 4):
+        weights, chunks = self._snapshot
+        scores = {}
+        for term, qtf in Counter(_tokenize(query)).items():
+            for cid, w in weights.get(term, ()):
+                scores[cid] = scores.get(cid, 0.0) + qtf * w
+        best = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+        return [(chunks[cid][0], chunks[cid][1], score) for cid, score in best]
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+def get_index(kb_dir: str) -> KBIndex:
+    """Process-wide index per KB directory; built on first use, then refreshed incrementally."""
+    kb_dir = os.path.abspath(kb_dir)
+    idx = _INDEXES.get(kb_dir)
+    if idx is None:
+        with _INDEXES_LOCK:
+            idx = _INDEXES.get(kb_dir)
+            if idx is None:
+                idx = KBIndex(kb_dir); idx.refresh(force=True)
+                _INDEXES[kb_dir] = idx
+    idx.refresh()
+    return idx
+
 def topk(query: str, docs, k: int = 4):
+    if isinstance(docs, KBIndex):
+        return docs.search(query, k)
     qv = _vec(query)
     scored = []
     for path, text in docs:
@@ -38,10 +163,7 @@ def topk(query: str, docs, k: int = 4):
     scored.sort(key=lambda x: x[2], reverse=True)
     return scored[:k]
 
-def build_context(query: str, docs, k: int = 4) -> str:
-    hits = topk(query, docs, k)
-    out = []
-    for path, text, score in hits:
-        snippet = text[:800].strip()
-        out.append(f"### {os.path.basename(path)} (score={score:.3f})\\n{snippet}")
-    return "\\n\\n".join(out)
+def build_context(query: str, docs, k: int = 4, budget: int = None) -> str:
+    """Top-k hits packed into `budget` tokens (default CONTEXT_TOKEN_BUDGET), see context_packer.pack."""
+    snippets = [Snippet(os.path.basename(path), text, score) for path, text, score in topk(query, docs, k)]
+    return pack(query, snippets, CONTEXT_TOKEN_BUDGET if budget is None else budget)[0]
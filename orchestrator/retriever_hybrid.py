@@ -0,0 +1,89 @@
+import os,re,time
+from concurrent.futures import ThreadPoolExecutor, wait
+from orchestrator import retriever_qdrant, retriever_local
+from orchestrator.rag_simple import get_index
+from orchestrator.metrics import inc, observe
+
+HYBRID_DEADLINE_MS=float(os.environ.get('HYBRID_DEADLINE_MS','1500'))
+HYBRID_WORKERS=int(os.environ.get('HYBRID_WORKERS','8'))
+RRF_K=int(os.environ.get('RRF_K','60'))
+SNIPPET_CHARS=int(os.environ.get('HYBRID_SNIPPET_CHARS','600'))
+
+# retrievers run side by side on this pool; one that misses the deadline is dropped from the fusion
+# (its thread finishes in the background, so the pool bounds how many stragglers can pile up)
+_POOL=ThreadPoolExecutor(max_workers=HYBRID_WORKERS,thread_name_prefix='retrieve')
+
+def _lexical(query,k,filters,kb_dir):
+    return [{'uri':path,'chunk_index':None,'text':text,'score':score} for path,text,score in get_index(kb_dir).search(query,k)]
+
+def vector_backend():
+    if retriever_qdrant.QDRANT_URL: return retriever_qdrant
+    if retriever_local.LOCAL_VECTOR_DIR and retriever_local.get_store() is not None: return retriever_local
+    return None
+
+def _vector(query,k,filters,kb_dir):
+    out=[]
+    for h in vector_backend().search(query,k,filters):
+        pl=h.get('payload') or {}
+        out.append({'uri':pl.get('uri',''),'chunk_index':pl.get('chunk_index'),'text':pl.get('text') or '','score':h.get('score',0.0)})
+    return out
+
+def _timed(name,fn,*args):
+    t0=time.perf_counter()
+    try: return fn(*args),None,round((time.perf_counter()-t0)*1000,1)
+    except Exception as e: return None,str(e),round((time.perf_counter()-t0)*1000,1)
+    finally: observe('wms_retriever_seconds',time.perf_counter()-t0,retriever=name)
+
+def _fingerprint(h):
+    return re.sub(r'\W+',' ',h['text'].lower()).strip() if h['text'] else f"{h['uri']}#{h['chunk_index']}"
+
+def fuse(ranked,k):
+    """Reciprocal rank fusion over {retriever: [hit, ...]}. Hits with the same normalised text, or whose text
+    is contained in another's (overlapping chunks), collapse into one entry that keeps the longest text."""
+    merged=[]
+    for name,hits in ranked.items():
+        for rank,h in enumerate(hits):
+            fp=_fingerprint(h); score=1.0/(RRF_K+rank+1)
+            same=next((m for m in merged if m['fp']==fp or (h['text'] and m['text'] and (fp in m['fp'] or m['fp'] in fp))),None)
+            if same is None:
+                merged.append(dict(h,fp=fp,rrf=score,sources=[name])); continue
+            same['rrf']+=score
+            if name not in same['sources']: same['sources'].append(name)
+            if len(fp)>len(same['fp']): same.update(h,fp=fp)
+    merged.sort(key=lambda m:m['rrf'],reverse=True)
+    return [{kk:v for kk,v in m.items() if kk!='fp'} for m in merged[:k]]
+
+def search(query,k=6,filters=None,kb_dir=None,deadline_ms=None):
+    """Lexical (BM25 over kb_dir) and vector (Qdrant or local store) retrieval run concurrently under one
+    deadline, fused with RRF. Returns (hits, timings); timings has <name>_ms per retriever plus total_ms,
+    and <name>_timeout / <name>_error set to 1 for a retriever that did not contribute."""
+    t0=time.perf_counter()
+    deadline=(HYBRID_DEADLINE_MS if deadline_ms is None else deadline_ms)/1000.0
+    names=['lexical']+(['vector'] if vector_backend() else [])
+    fns={'lexical':_lexical,'vector':_vector}
+    futs={_POOL.submit(_timed,n,fns[n],query,2*k,filters,kb_dir):n for n in names}
+    done,_=wait(futs,timeout=deadline)
+    ranked,timings={},{}
+    for f,name in futs.items():
+        if f not in done:
+            f.cancel(); timings[f'{name}_ms']=round(deadline*1000,1); timings[f'{name}_timeout']=1.0
+            inc('wms_retriever_timeouts_total',retriever=name); continue
+        hits,err,ms=f.result()
+        timings[f'{name}_ms']=ms
+        if err: timings[f'{name}_error']=1.0
+        else: ranked[name]=hits
+    hits=fuse(ranked,k)
+    timings['total_ms']=round((time.perf_counter()-t0)*1000,1)
+    return hits,timings
+
+def build_context(query,k=6,filters=None,kb_dir=None,deadline_ms=None):
+    """(context text, timings) for the fused hits, with snippet text for every hit that has it."""
+    hits,timings=search(query,k,filters,kb_dir,deadline_ms)
+    if not hits: return '',timings
+    parts=[]
+    for h in hits:
+        label=os.path.basename(h['uri']) or h['uri']
+        if h['chunk_index'] is not None: label+=f"#{h['chunk_index']}"
+        snippet=h['text'][:SNIPPET_CHARS].strip() or '(no text stored for this chunk)'
+        parts.append(f"### {label} (rrf={h['rrf']:.4f}; {'+'.join(h['sources'])})\n{snippet}")
+    return 'Top hits (hybrid lexical+vector):\n'+'\n\n'.join(parts),timings
@@ -0,0 +1,236 @@
+import os,json,threading
+try:
+    import numpy as np
+except ImportError:  # optional extra, see setup_extras.sh
+    np=None
+from orchestrator.embedder import EMB_DIM,EMBED_NGRAMS,embed_batch as hash_embed_batch
+from orchestrator.retriever_qdrant import _openai_embed, snippet
+
+LOCAL_VECTOR_DIR=os.environ.get('LOCAL_VECTOR_DIR')
+IVF_NPROBE=int(os.environ.get('LOCAL_IVF_NPROBE','8'))
+IVF_MIN_ROWS=int(os.environ.get('LOCAL_IVF_MIN_ROWS','50000'))
+
+# On-disk layout (all files are read-only once written, so uvicorn workers share the pages via the OS cache):
+#   vectors.npy      float32 [N, dim], L2-normalised, opened with mmap_mode='r'
+#   uri_id.npy       int32 [N]  -> payload.json["uris"]
+#   chunk_index.npy  int32 [N]
+#   module_id.npy    int16 [N]  -> payload.json["modules"]
+#   payload.json     {"uris": [...], "modules": [...], "tag_vocab": [...], "tags": [[tag ids], ...], "texts": [...]}
+#   tag_rows.npy     int32, row ids grouped by tag (CSR postings); tag t owns tag_rows[tag_offsets[t]:tag_offsets[t+1]]
+#   tag_offsets.npy  int64 [len(tag_vocab)+1]
+#   ivf_*.npy        optional coarse quantizer (centroids, rows sorted by list, list offsets)
+#   manifest.json    written last; {"dim", "count", "embedder", "ivf"} (+ "ngrams" for the hash embedder)
+
+def _tag_postings(tags,ntags):
+    """CSR postings (rows, offsets) from per-row tag id lists."""
+    lens=np.fromiter((len(t) for t in tags),dtype=np.int64,count=len(tags))
+    flat=np.fromiter((t for ts in tags for t in ts),dtype=np.int64,count=int(lens.sum()))
+    rows=np.repeat(np.arange(len(tags),dtype=np.int32),lens)[np.argsort(flat,kind='stable')]
+    offsets=np.zeros(ntags+1,dtype=np.int64)
+    np.cumsum(np.bincount(flat,minlength=ntags),out=offsets[1:])
+    return rows,offsets
+
+class LocalVectorStore:
+    def __init__(self,path):
+        self.path=path
+        with open(os.path.join(path,'manifest.json'),'r',encoding='utf-8') as f: self.manifest=json.load(f)
+        with open(os.path.join(path,'payload.json'),'r',encoding='utf-8') as f: meta=json.load(f)
+        self.uris=meta['uris']; self.modules=meta['modules']
+        self.tag_vocab=meta.get('tag_vocab',[]); self.tags=meta.get('tags',[]); self.texts=meta.get('texts',[])
+        load=lambda n: np.load(os.path.join(path,n),mmap_mode='r')
+        self.vectors=load('vectors.npy')
+        self.uri_id=load('uri_id.npy'); self.chunk_index=load('chunk_index.npy'); self.module_id=load('module_id.npy')
+        if os.path.exists(os.path.join(path,'tag_offsets.npy')):
+            self.tag_rows,self.tag_offsets=load('tag_rows.npy'),load('tag_offsets.npy')
+        else:  # store written before tag postings were added
+            self.tag_rows,self.tag_offsets=_tag_postings(self.tags,len(self.tag_vocab))
+        self.ivf=None
+        if self.manifest.get('ivf'):
+            self.ivf=(load('ivf_centroids.npy'),load('ivf_rows.npy'),load('ivf_offsets.npy'))
+
+    def __len__(self): return int(self.vectors.shape[0])
+
+    def _embed(self,text):
+        if self.manifest.get('embedder')=='hash':
+            return hash_embed_batch([text],self.manifest['dim'],self.manifest.get('ngrams',1))[0]
+        q=np.asarray(_openai_embed(text),dtype=np.float32)
+        n=float(np.linalg.norm(q))
+        return q/n if n else q
+
+    def _mask(self,rows,filters):
+        mask=None
+        for key,val in (filters or {}).items():
+            if key=='module': vocab,col=self.modules,self.module_id
+            elif key=='uri': vocab,col=self.uris,self.uri_id
+            elif key=='tags':
+                m=np.zeros(len(self),dtype=bool)
+                if val in self.tag_vocab:
+                    t=self.tag_vocab.index(val)
+                    m[self.tag_rows[self.tag_offsets[t]:self.tag_offsets[t+1]]]=True
+                if rows is not None: m=m[rows]
+                mask=m if mask is None else mask&m; continue
+            else: continue
+            vid=vocab.index(val) if val in vocab else -1
+            m=(col[rows] if rows is not None else col)==vid
+            mask=m if mask is None else mask&m
+        return mask
+
+    def _candidates(self,q):
+        if self.ivf is None or len(self)<IVF_MIN_ROWS: return None
+        centroids,ivf_rows,offsets=self.ivf
+        probe=np.argsort(-(centroids@q))[:IVF_NPROBE]
+        return np.concatenate([ivf_rows[offsets[c]:offsets[c+1]] for c in probe])
+
+    def search(self,query,k=6,filters=None):
+        if not len(self): return []
+        q=self._embed(query)
+        rows=self._candidates(q)
+        mask=self._mask(rows,filters)
+        if rows is not None and mask is not None: rows,mask=rows[mask],None
+        if rows is None:
+            scores=self.vectors@q
+            if mask is not None: scores=np.where(mask,scores,-np.inf)
+            ids=np.arange(len(self))
+        else:
+            ids=np.sort(rows)
+            scores=self.vectors[ids]@q if len(ids) else np.empty(0,dtype=np.float32)
+        k=min(k,len(scores))
+        if k<=0: return []
+        top=np.argpartition(-scores,k-1)[:k]
+        top=top[np.argsort(-scores[top])]
+        hits=[]
+        for i in top:
+            if not np.isfinite(scores[i]): break
+            r=int(ids[i])
+            hits.append({'id':r,'score':float(scores[i]),'payload':{
+                'uri':self.uris[self.uri_id[r]],'chunk_index':int(self.chunk_index[r]),
+                'module':self.modules[self.module_id[r]],
+                'tags':[self.tag_vocab[t] for t in self.tags[r]] if r<len(self.tags) else [],
+                'text':self.texts[r] if r<len(self.texts) else ''}})
+        return hits
+
+def _kmeans(vecs,nlist,iters=10,seed=0):
+    rng=np.random.default_rng(seed)
+    sample=vecs[rng.choice(len(vecs),size=min(len(vecs),nlist*64),replace=False)]
+    cent=sample[rng.choice(len(sample),size=nlist,replace=False)].copy()
+    for _ in range(iters):
+        assign=np.argmax(sample@cent.T,axis=1)
+        for c in range(nlist):
+            members=sample[assign==c]
+            if len(members): cent[c]=members.mean(axis=0)
+        cent/=np.linalg.norm(cent,axis=1,keepdims=True)+1e-12
+    return cent
+
+def build_store(path,records,embedder='openai',dim=EMB_DIM,nlist=0,ngrams=None):
+    """Write a store from records of {'vector', 'uri', 'chunk_index', 'module', 'tags', 'text'}."""
+    os.makedirs(path,exist_ok=True)
+    n=len(records)
+    vecs=np.lib.format.open_memmap(os.path.join(path,'vectors.npy.tmp'),mode='w+',dtype=np.float32,shape=(n,dim))
+    uris,modules,tag_vocab={},{},{}
+    uri_id=np.empty(n,dtype=np.int32); chunk_index=np.empty(n,dtype=np.int32); module_id=np.empty(n,dtype=np.int16)
+    tags,texts=[],[]
+    for i,rec in enumerate(records):
+        v=np.asarray(rec['vector'],dtype=np.float32)
+        vecs[i]=v/(np.linalg.norm(v) or 1.0)
+        uri_id[i]=uris.setdefault(rec.get('uri',''),len(uris))
+        chunk_index[i]=int(rec.get('chunk_index',0))
+        module_id[i]=modules.setdefault(rec.get('module','Unknown'),len(modules))
+        tags.append([tag_vocab.setdefault(t,len(tag_vocab)) for t in rec.get('tags') or []])
+        texts.append(rec.get('text') or '')
+    vecs.flush(); del vecs
+    os.replace(os.path.join(path,'vectors.npy.tmp'),os.path.join(path,'vectors.npy'))
+    tag_rows,tag_offsets=_tag_postings(tags,len(tag_vocab))
+    for name,arr in (('uri_id',uri_id),('chunk_index',chunk_index),('module_id',module_id),
+                     ('tag_rows',tag_rows),('tag_offsets',tag_offsets)):
+        np.save(os.path.join(path,name+'.npy'),arr)
+    with open(os.path.join(path,'payload.json'),'w',encoding='utf-8') as f:
+        meta={'uris':list(uris),'modules':list(modules),'tag_vocab':list(tag_vocab),'tags':tags}
+        if any(texts): meta['texts']=texts
+        json.dump(meta,f,separators=(',',':'))
+    ivf=bool(nlist) and n>=nlist
+    if ivf:
+        vecs=np.load(os.path.join(path,'vectors.npy'),mmap_mode='r')
+        cent=_kmeans(vecs,nlist)
+        assign=np.concatenate([np.argmax(vecs[s:s+65536]@cent.T,axis=1) for s in range(0,n,65536)])
+        order=np.argsort(assign,kind='stable').astype(np.int64)
+        offsets=np.searchsorted(assign[order],np.arange(nlist+1)).astype(np.int64)
+        np.save(os.path.join(path,'ivf_centroids.npy'),cent)
+        np.save(os.path.join(path,'ivf_rows.npy'),order)
+        np.save(os.path.join(path,'ivf_offsets.npy'),offsets)
+    with open(os.path.join(path,'manifest.json'),'w',encoding='utf-8') as f:
+        manifest={'dim':dim,'count':n,'embedder':embedder,'ivf':ivf}
+        if embedder=='hash': manifest['ngrams']=ngrams or EMBED_NGRAMS
+        json.dump(manifest,f)
+    return n
+
+def records_from_kb(kb_dir,module='Unknown',tags=None,embedder='hash'):
+    from orchestrator.rag_simple import load_kb,_chunk
+    out=[]
+    for path,text in load_kb(kb_dir):
+        pieces=_chunk(text)
+        vecs=hash_embed_batch(pieces) if embedder=='hash' and pieces else [_openai_embed(p) for p in pieces]
+        for i,vec in enumerate(vecs):
+            out.append({'vector':vec,'uri':path,'chunk_index':i,'module':module,'tags':tags or [],'text':pieces[i]})
+    return out
+
+def records_from_qdrant(qdrant_url,collection,page=1024):
+    import requests
+    out,offset=[],None
+    while True:
+        body={'limit':page,'with_payload':True,'with_vector':True}
+        if offset is not None: body['offset']=offset
+        r=requests.post(f"{qdrant_url}/collections/{collection}/points/scroll",json=body,timeout=60); r.raise_for_status()
+        res=r.json().get('result',{})
+        for p in res.get('points',[]):
+            pl=p.get('payload',{})
+            out.append({'vector':p['vector'],'uri':pl.get('uri',''),'chunk_index':pl.get('chunk_index',0),
+                        'module':pl.get('module','Unknown'),'tags':pl.get('tags',[]),'text':pl.get('text','')})
+        offset=res.get('next_page_offset')
+        if offset is None: return out
+
+_store=None
+_store_key=None
+_store_lock=threading.Lock()
+
+def get_store(path=None):
+    global _store,_store_key
+    path=path or LOCAL_VECTOR_DIR
+    if np is None or not path: return None
+    try: key=(path,os.stat(os.path.join(path,'manifest.json')).st_mtime)
+    except OSError: return None
+    if _store_key!=key:
+        with _store_lock:
+            if _store_key!=key: _store,_store_key=LocalVectorStore(path),key
+    return _store
+
+def search(query,k=6,filters=None):
+    store=get_store()
+    return store.search(query,k,filters) if store else []
+
+def build_context(query,k=6,filters=None):
+    hits=search(query,k,filters)
+    if not hits: return ''
+    parts=[]
+    for h in hits:
+        pl=h.get('payload',{})
+        parts.append(f"- [{h.get('score',0):.3f}] {pl.get('uri','')}#{pl.get('chunk_index','?')}"+snippet(pl))
+    return 'Top hits from local vector store:\n'+'\n'.join(parts)
+
+if __name__=='__main__':
+    import argparse
+    ap=argparse.ArgumentParser(description='Build the local memory-mapped vector store')
+    ap.add_argument('out',nargs='?',default=LOCAL_VECTOR_DIR)
+    ap.add_argument('--kb',help='index a KB directory (chunked like rag_simple)')
+    ap.add_argument('--module',default='Unknown')
+    ap.add_argument('--embedder',choices=['hash','openai'],default='hash')
+    ap.add_argument('--from-qdrant',action='store_true',help='export vectors+payloads from QDRANT_URL')
+    ap.add_argument('--nlist',type=int,default=0,help='IVF lists (0 = brute force only)')
+    a=ap.parse_args()
+    if not a.out: ap.error('output dir required (or set LOCAL_VECTOR_DIR)')
+    if a.from_qdrant:
+        from orchestrator.retriever_qdrant import QDRANT_URL,QCOL
+        recs,emb=records_from_qdrant(QDRANT_URL,QCOL),'openai'
+    else:
+        recs,emb=records_from_kb(a.kb or 'kb',a.module,embedder=a.embedder),a.embedder
+    dim=len(recs[0]['vector']) if recs else EMB_DIM
+    print(build_store(a.out,recs,embedder=emb,dim=dim,nlist=a.nlist),'vectors written to',a.out)
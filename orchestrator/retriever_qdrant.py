@@ -1,14 +1,11 @@
-import os,requests,math,re
+import os,requests
+from orchestrator.embedder import EMB_DIM,embed as hash_embed
 QDRANT_URL=os.environ.get('QDRANT_URL')
 QCOL=os.environ.get('QDRANT_COLLECTION','wms_kb')
-EMB_DIM=int(os.environ.get('EMBED_DIM','1536'))
 OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY')
 
 def _hash_embed(text,dim=EMB_DIM):
-    v=[0.0]*dim
-    for tok in re.findall(r'[A-Za-z0-9_]+',text.lower()): v[hash(tok)%dim]+=1.0
-    n=math.sqrt(sum(x*x for x in v)) or 1.0
-    return [x/n for x in v]
+    return hash_embed(text,dim)
 
 def _openai_embed(text):
     if not OPENAI_API_KEY:
@@ -31,11 +28,15 @@ def search(query,k=6,filters=None):
     if not r.ok: return []
     return r.json().get('result',[])
 
+def snippet(payload,n=300):
+    t=' '.join((payload.get('text') or '').split())
+    return f": {t[:n]}" if t else ''
+
 def build_context(query,k=6,filters=None):
     hits=search(query,k,filters)
     if not hits: return ''
     parts=[]
     for h in hits:
         pl=h.get('payload',{})
-        parts.append(f"- [{h.get('score',0):.3f}] {pl.get('uri','')}#{pl.get('chunk_index','?')}")
+        parts.append(f"- [{h.get('score',0):.3f}] {pl.get('uri','')}#{pl.get('chunk_index','?')}"+snippet(pl))
     return 'Top hits from Qdrant:\n'+'\n'.join(parts)
@@ -1,5 +1,4 @@
-
-import os, zipfile
+import os, time, zipfile
 
 def export_zip(out_dir: str) -> str:
     zip_path = out_dir.rstrip("/")+ ".zip"
@@ -10,3 +9,60 @@ def export_zip(out_dir: str) -> str:
                 arc = os.path.relpath(p, out_dir)
                 z.write(p, arc)
     return zip_path
+
+class _Sink:
+    # write-only, non-seekable target: zipfile falls back to streaming mode and we hand out bytes as they are produced
+    def __init__(self):
+        self._parts, self._pos = [], 0
+    def write(self, b):
+        self._parts.append(bytes(b)); self._pos += len(b)
+        return len(b)
+    def tell(self):
+        return self._pos
+    def flush(self):
+        pass
+    def drain(self) -> bytes:
+        out = b"".join(self._parts); self._parts = []
+        return out
+
+def _writestr(z, name: str, content, stamp):
+    info = zipfile.ZipInfo(name, date_time=stamp)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    z.writestr(info, content.encode("utf-8") if isinstance(content, str) else content)
+
+def stream_zip(artifacts: dict):
+    """Yield a deflated ZIP of {arc name: str|bytes} chunk by chunk, one member at a time."""
+    sink = _Sink()
+    stamp = time.localtime()[:6]
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, content in artifacts.items():
+            _writestr(z, name, content, stamp)
+            chunk = sink.drain()
+            if chunk: yield chunk
+    tail = sink.drain()
+    if tail: yield tail
+
+def write_zip(zip_path: str, artifacts: dict) -> str:
+    with open(zip_path, "wb") as f:
+        for chunk in stream_zip(artifacts):
+            f.write(chunk)
+    return zip_path
+
+def patch_zip(src_path: str, dst_path: str, changed: dict, removed=()) -> str:
+    """Write dst_path as a copy of the ZIP at src_path with the `changed` members ({arc name: str|bytes}) replaced
+    or appended and `removed` ones dropped. Untouched members keep their ZipInfo (name, timestamp, attributes,
+    compress_type) and are copied one at a time through the public zipfile API."""
+    stamp = time.localtime()[:6]
+    with zipfile.ZipFile(src_path) as src, zipfile.ZipFile(dst_path, "w", zipfile.ZIP_DEFLATED) as dst:
+        for info in src.infolist():
+            if info.filename in removed:
+                continue
+            if info.filename in changed:
+                _writestr(dst, info.filename, changed[info.filename], stamp)
+                continue
+            dst.writestr(info, src.read(info))
+        for name, content in changed.items():
+            if name not in src.NameToInfo:
+                _writestr(dst, name, content, stamp)
+    return dst_path
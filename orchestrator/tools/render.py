@@ -1,27 +1,82 @@
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape, meta, nodes
+from concurrent.futures import ThreadPoolExecutor
+import os, hashlib, tempfile
 
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-import os
+MODULES = ["inbound","outbound","inventory","cyclecount"]
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "8"))
+JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "wms_jinja_cache"))
+
+_ENV = None
+_FINGERPRINT = (None, None)  # (stat signature of the template files, sha256 of their sources)
+_POOL = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
 
 def _env():
-    here = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-    tpl_dir = os.path.join(here, "templates")
-    return Environment(
-        loader=FileSystemLoader(tpl_dir),
-        autoescape=select_autoescape([]),
-        trim_blocks=True,
-        lstrip_blocks=True,
-    )
+    # one Environment per process: compiled templates stay in its cache, bytecode survives restarts on disk
+    global _ENV
+    if _ENV is None:
+        here = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+        tpl_dir = os.path.join(here, "templates")
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        _ENV = Environment(
+            loader=FileSystemLoader(tpl_dir),
+            autoescape=select_autoescape([]),
+            trim_blocks=True,
+            lstrip_blocks=True,
+            bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR),
+        )
+    return _ENV
+
+def template_fingerprint():
+    """sha256 over every template's name and source. Jinja reloads edited templates, so this is re-hashed whenever
+    a template file's mtime or size changes."""
+    global _FINGERPRINT
+    env = _env()
+    root = env.loader.searchpath[0]
+    paths = sorted(os.path.join(r, f) for r, _, files in os.walk(root) for f in files if f.endswith(".j2"))
+    sig = tuple((p, st.st_mtime_ns, st.st_size) for p, st in ((p, os.stat(p)) for p in paths))
+    if _FINGERPRINT[0] != sig:
+        h = hashlib.sha256()
+        for p in paths:
+            h.update(os.path.relpath(p, root).replace(os.sep, "/").encode("utf-8") + b"\0")
+            with open(p, "rb") as f:
+                h.update(f.read() + b"\0")
+        _FINGERPRINT = (sig, h.hexdigest())
+    return _FINGERPRINT[1]
+
+def warm_templates():
+    """Compile every module + common template (and work out the context paths it reads) up front;
+    returns the number loaded."""
+    env = _env()
+    names = [n for n in env.list_templates(extensions=["j2"]) if n.split("/")[0] in MODULES + ["common"]]
+    for n in names:
+        env.get_template(n)
+        template_dependencies(n)
+    return len(names)
 
 def _write(path: str, content: str):
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
-        f.write(content.strip() + "\n")
+        f.write(content)
 
-def render_designpack(module: str, req: dict, out_dir: str, extra: dict=None):
-    env = _env()
-    files = []
+def _plan(module: str):
+    mod = module.lower()
+    if mod not in MODULES:
+        raise ValueError("Unsupported module")
+    return [
+        ("common/overview.md.j2", "overview.md"),
+        ("common/nfr.md.j2", "nfr.md"),
+        ("common/ui_wireframes.md.j2", "ui_wireframes.md"),
+    ] + [(f"{mod}/{name}", name.replace(".j2","")) for name in [
+        "c4_context.mmd.j2",
+        "c4_container.mmd.j2",
+        f"sequence_{mod}.mmd.j2",
+        f"erd_{mod}.mmd.j2",
+        "deployment.mmd.j2",
+        f"openapi_{mod}.json.j2",
+        f"backlog_{mod}.md.j2",
+    ]]
 
-    # Common context
+def _context(module: str, req: dict, extra: dict=None):
     ctx = {
         "project": req.get("project", "WMS"),
         "domain": req.get("domain", "WMS"),
@@ -35,36 +90,94 @@ def render_designpack(module: str, req: dict, out_dir: str, extra: dict=None):
     }
     if extra:
         ctx.update(extra)
+    return ctx
 
-    # Overview / NFR / UI
-    t = env.get_template("common/overview.md.j2")
-    _write(os.path.join(out_dir, "overview.md"), t.render(**ctx)); files.append("overview.md")
-    t = env.get_template("common/nfr.md.j2")
-    _write(os.path.join(out_dir, "nfr.md"), t.render(**ctx)); files.append("nfr.md")
-    t = env.get_template("common/ui_wireframes.md.j2")
-    _write(os.path.join(out_dir, "ui_wireframes.md"), t.render(**ctx)); files.append("ui_wireframes.md")
+_DEPS = {}  # template name -> frozenset of context paths it reads, or None when it cannot be determined
 
-    # Module templates
-    mod = module.lower()
-    if mod not in ["inbound","outbound","inventory","cyclecount"]:
-        raise ValueError("Unsupported module")
+def _path(node):
+    # ("constraints", "latency_scan_ms") for constraints.latency_scan_ms, constraints["latency_scan_ms"] and
+    # constraints.get("latency_scan_ms", ...); None for anything else
+    if isinstance(node, nodes.Name):
+        return (node.name,)
+    if isinstance(node, nodes.Getattr):
+        base = _path(node.node)
+        return base and base + (node.attr,)
+    if isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const):
+        base = _path(node.node)
+        return base and base + (node.arg.value,)
+    if isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr) and node.node.attr == "get" \
+            and node.args and isinstance(node.args[0], nodes.Const):
+        base = _path(node.node.node)
+        return base and base + (node.args[0].value,)
+    return None
 
-    base_names = [
-        "c4_context.mmd.j2",
-        "c4_container.mmd.j2",
-        f"sequence_{mod}.mmd.j2",
-        f"erd_{mod}.mmd.j2",
-        "deployment.mmd.j2",
-        f"openapi_{mod}.json.j2",
-        f"backlog_{mod}.md.j2",
-    ]
-    for name in base_names:
-        t = env.get_template(f"{mod}/{name}")
-        out_name = name.replace(".j2","")
-        _write(os.path.join(out_dir, out_name), t.render(**ctx)); files.append(out_name)
+def _reads(node, out: set):
+    p = _path(node)
+    if p is not None:
+        out.add(p)
+        if isinstance(node, nodes.Call):
+            for child in node.args[1:] + [kw.value for kw in node.kwargs]:
+                _reads(child, out)
+        return
+    if isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr):
+        # method call (items(), keys(), ...): depends on the whole object
+        _reads(node.node.node, out)
+        for child in node.args + [kw.value for kw in node.kwargs]:
+            _reads(child, out)
+        return
+    for child in node.iter_child_nodes():
+        _reads(child, out)
+
+def template_dependencies(tpl_name: str):
+    """Context paths a template reads, e.g. {("module",), ("constraints", "latency_scan_ms")}, including those of
+    templates it extends/includes/imports. None when a referenced template name is dynamic."""
+    if tpl_name not in _DEPS:
+        env = _env()
+        ast = env.parse(env.loader.get_source(env, tpl_name)[0])
+        names = meta.find_undeclared_variables(ast)
+        found = set()
+        _reads(ast, found)
+        deps = {p for p in found if p[0] in names}
+        for ref in meta.find_referenced_templates(ast):
+            sub = template_dependencies(ref) if ref is not None else None
+            if sub is None:
+                deps = None
+                break
+            deps |= sub
+        _DEPS[tpl_name] = None if deps is None else frozenset(deps)
+    return _DEPS[tpl_name]
+
+def affected_artifacts(module: str, changed):
+    """Artifact names whose templates read any of the `changed` context paths (a path also matches its parents
+    and children: changing ("constraints",) affects a read of ("constraints", "latency_scan_ms") and vice versa)."""
+    out = []
+    for tpl, name in _plan(module):
+        deps = template_dependencies(tpl)
+        if deps is None or any(d[:len(c)] == c or c[:len(d)] == d for d in deps for c in changed):
+            out.append(name)
+    return out
+
+def render_artifacts(module: str, req: dict, extra: dict=None, out_dir: str=None, only=None):
+    """Render all artifacts (or just the names in `only`) concurrently; returns {file name: content}.
+    Files are written only if out_dir is given."""
+    env = _env()
+    ctx = _context(module, req, extra)
+
+    def one(tpl_name, out_name):
+        content = env.get_template(tpl_name).render(**ctx).strip() + "\n"
+        if out_dir:
+            _write(os.path.join(out_dir, out_name), content)
+        return out_name, content
+
+    futures = [_POOL.submit(one, t, o) for t, o in _plan(module) if only is None or o in only]
+    rendered = dict(f.result() for f in futures)
 
     # Assumptions
-    if "assumptions_md" in ctx:
-        _write(os.path.join(out_dir, "assumptions.md"), ctx["assumptions_md"]); files.append("assumptions.md")
+    if "assumptions_md" in ctx and (only is None or "assumptions.md" in only):
+        rendered["assumptions.md"] = ctx["assumptions_md"].strip() + "\n"
+        if out_dir:
+            _write(os.path.join(out_dir, "assumptions.md"), rendered["assumptions.md"])
+    return rendered
 
-    return files
+def render_designpack(module: str, req: dict, out_dir: str, extra: dict=None):
+    return list(render_artifacts(module, req, extra, out_dir=out_dir))
@@ -0,0 +1,152 @@
+import os, hashlib, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from orchestrator.metrics import span, inc
+
+VALIDATION_WORKERS = int(os.environ.get("VALIDATION_WORKERS", "0"))
+VALIDATION_CACHE_ITEMS = int(os.environ.get("VALIDATION_CACHE_ITEMS", "2048"))
+
+# Validation engine: every artifact a rule needs is parsed once into a model (shared by all rules and cached by
+# content hash), and every rule result is cached by the hashes of the artifacts it reads. Adding a rule adds one
+# function call over already-parsed models; re-validating a pack where one artifact changed re-runs only the rules
+# that read it.
+
+MODELS = {}  # model name -> (artifact file name pattern, parser)
+RULES = {}   # rule name -> (function(models) -> [issue, ...], model names it reads)
+
+class ArtifactError(Exception):
+    """Raised by Models[...] when the artifact behind a model is missing or failed to parse."""
+
+class MissingArtifact(ArtifactError):
+    def __str__(self):
+        return "Read error: missing artifact"
+
+def model(name: str, filename: str):
+    """Register a parser text -> model for the artifact `filename` ('{mod}' is replaced by the lower-case module)."""
+    def deco(fn):
+        MODELS[name] = (filename, fn)
+        return fn
+    return deco
+
+def rule(name: str, *needs: str):
+    """Register fn(models) -> [issue, ...] as validation rule `name`, reading the models listed in `needs`."""
+    def deco(fn):
+        RULES[name] = (fn, needs)
+        return fn
+    return deco
+
+class _LRU:
+    def __init__(self, items):
+        self.items = items
+        self._d = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            v = self._d.get(key)
+            if v is not None:
+                self._d.move_to_end(key)
+            return v
+
+    def put(self, key, value):
+        with self._lock:
+            self._d[key] = value
+            self._d.move_to_end(key)
+            while len(self._d) > self.items:
+                self._d.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+
+_parsed = _LRU(VALIDATION_CACHE_ITEMS)   # (model, digest) -> (ok, model or error message)
+_results = _LRU(VALIDATION_CACHE_ITEMS)  # (rule, digests of its models) -> tuple of issues
+_pool = None
+
+def _digest(text):
+    return None if text is None else hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+class Models:
+    """Parsed models of one pack. Missing or unparseable artifacts raise ArtifactError on access.
+    Models are shared between rules (and cached across packs): rules must not mutate them."""
+
+    def __init__(self, parsed):
+        self._parsed = parsed
+
+    def __getitem__(self, name):
+        ok, value = self._parsed[name]
+        if ok:
+            return value
+        if value is None:
+            raise MissingArtifact()
+        raise ArtifactError(value)
+
+def parse(name: str, text, digest=None):
+    """(ok, model or error message) for one artifact text; None text means the artifact is missing."""
+    if text is None:
+        return False, None
+    key = (name, digest or _digest(text))
+    hit = _parsed.get(key)
+    if hit is None:
+        try:
+            hit = True, MODELS[name][1](text)
+        except Exception as e:
+            hit = False, str(e)
+        _parsed.put(key, hit)
+    return hit
+
+def _run_rule(name, models):
+    fn, _ = RULES[name]
+    with span("validator", validator=name):
+        try:
+            return list(fn(models)), True
+        except Exception as e:
+            return [f"Rule {name} failed: {e}"], False
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=VALIDATION_WORKERS, thread_name_prefix="validate")
+    return _pool
+
+def run(module: str, artifacts: dict, rules=None):
+    """Run `rules` (default: all registered, in registration order) over in-memory artifacts ({file name: content}).
+    Returns {rule name: [issue, ...]}."""
+    mod = module.lower()
+    names = list(RULES if rules is None else rules)
+    texts, digests = {}, {}
+    for name in names:
+        for m in RULES[name][1]:
+            if m not in texts:
+                texts[m] = artifacts.get(MODELS[m][0].format(mod=mod))
+                digests[m] = _digest(texts[m])
+    out, todo = {}, []
+    for name in names:
+        key = (name,) + tuple(digests[m] for m in RULES[name][1])
+        hit = _results.get(key)
+        if hit is not None:
+            out[name] = list(hit)
+            inc("wms_validation_cache_hits_total", rule=name)
+        else:
+            todo.append((name, key))
+    if todo:
+        needed = {m for name, _ in todo for m in RULES[name][1]}
+        models = Models({m: parse(m, texts[m], digests[m]) for m in needed})
+        if VALIDATION_WORKERS > 1 and len(todo) > 1:
+            done = list(_get_pool().map(lambda t: _run_rule(t[0], models), todo))
+        else:
+            done = [_run_rule(name, models) for name, _ in todo]
+        for (name, key), (issues, ok) in zip(todo, done):
+            if ok:
+                _results.put(key, tuple(issues))
+            out[name] = issues
+    return {name: out[name] for name in names}
+
+def rules_for(module: str, files):
+    """Names of the registered rules that read any of the artifacts in `files`."""
+    mod, files = module.lower(), set(files)
+    return [name for name, (_, needs) in RULES.items() if any(MODELS[m][0].format(mod=mod) in files for m in needs)]
+
+def clear_cache():
+    _parsed.clear()
+    _results.clear()
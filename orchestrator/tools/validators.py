@@ -1,59 +1,125 @@
 
 import json, re
+from orchestrator.tools.validation import model, rule, parse, run, Models, ArtifactError, RULES
+try:
+    from openapi_spec_validator import validate_spec  # optional
+except ImportError:
+    validate_spec = None
 
-def validate_openapi(openapi_path: str):
-    issues = []
-    try:
-        data = json.load(open(openapi_path,"r"))
-        try:
-            from openapi_spec_validator import validate_spec  # optional
-            validate_spec(data)
-        except Exception as e:
-            if "openapi" not in data: issues.append("Missing 'openapi' field.")
-            if "paths" not in data: issues.append("Missing 'paths' object.")
-    except Exception as e:
-        issues.append(f"Cannot parse OpenAPI JSON: {e}")
-    return issues
+_ERD_ENTITY_RE = re.compile(r"^[ \t]*([A-Za-z_][\w-]*)[ \t]*\{(.*?)\}", re.M | re.S)
+_NODE_RE = re.compile(r"\b([A-Za-z_]\w*)[ \t]*[\[\(\{]+([^\]\)\}\n]+)[\]\)\}]+")
+_LATENCY_RE = re.compile(r"latency.*?(\d+)\s*ms")
+_AVAILABILITY_RE = re.compile(r"availability\W+(\d+(?:\.\d+)?)\s*%")
 
-def _parse_erd_fields(erd_text: str):
-    fields = []
-    entity_block_re = re.compile(r"\{\{(.+?)\}\}", re.DOTALL)
-    for block in entity_block_re.findall(erd_text):
-        for line in block.splitlines():
-            parts = line.strip().split()
-            if len(parts) >= 2:
-                fields.append(parts[1])
-    return list(sorted(set([f for f in fields if f.isidentifier()])))
+def _read(path: str):
+    with open(path,"r",encoding="utf-8") as f:
+        return f.read()
+
+# ---------- models: each artifact is parsed once per content hash and shared by every rule ----------
+
+class OpenAPI:
+    """Decoded OpenAPI document and the names of all schema properties in it."""
+    def __init__(self, data):
+        self.data = data
+        self.properties = frozenset(_openapi_props(data))
+
+class ERD:
+    """Mermaid erDiagram as {entity: (field, ...)}."""
+    def __init__(self, entities: dict):
+        self.entities = entities
+        self.fields = frozenset(f for fields in entities.values() for f in fields)
+
+class Deployment:
+    """Mermaid deployment graph as {node id: lower-case label}."""
+    def __init__(self, nodes: dict):
+        self.nodes = nodes
+
+    def has(self, *terms):
+        return any(t in label or t in node.lower() for node, label in self.nodes.items() for t in terms)
+
+class NFR:
+    """Numeric targets found in the NFR document, e.g. {"latency_ms": 300, "availability_pct": 99.9}."""
+    def __init__(self, targets: dict):
+        self.targets = targets
 
 def _openapi_props(data):
-    props = set()
-    def walk(node):
+    props, stack = set(), [data]
+    while stack:
+        node = stack.pop()
         if isinstance(node, dict):
             for k,v in node.items():
                 if k == "properties" and isinstance(v, dict):
-                    for p in v.keys():
-                        props.add(p)
-                walk(v)
+                    props.update(v.keys())
+                stack.append(v)
         elif isinstance(node, list):
-            for it in node:
-                walk(it)
-    walk(data)
+            stack.extend(node)
     return sorted(props)
 
-def check_api_vs_erd(openapi_json_path: str, erd_path: str):
+def _erd_entities(erd_text: str):
+    entities = {}
+    for name, block in _ERD_ENTITY_RE.findall(erd_text):
+        fields = entities.setdefault(name, [])
+        for line in block.splitlines():
+            parts = line.strip().split()
+            if len(parts) >= 2 and parts[1].isidentifier():
+                fields.append(parts[1])
+    return {k: tuple(v) for k,v in entities.items()}
+
+def _parse_erd_fields(erd_text: str):
+    return sorted({f for fields in _erd_entities(erd_text).values() for f in fields})
+
+@model("openapi", "openapi_{mod}.json")
+def parse_openapi(text: str):
+    return OpenAPI(json.loads(text))
+
+@model("erd", "erd_{mod}.mmd")
+def parse_erd(text: str):
+    return ERD(_erd_entities(text))
+
+@model("deployment", "deployment.mmd")
+def parse_deployment(text: str):
+    return Deployment({node: label.strip().lower() for node, label in _NODE_RE.findall(text)})
+
+@model("nfr", "nfr.md")
+def parse_nfr(text: str):
+    low, targets = text.lower(), {}
+    m = _LATENCY_RE.search(low)
+    if m: targets["latency_ms"] = int(m.group(1))
+    m = _AVAILABILITY_RE.search(low)
+    if m: targets["availability_pct"] = float(m.group(1))
+    return NFR(targets)
+
+# ---------- rules: fn(models) -> [issue, ...], registered in report order ----------
+
+@rule("openapi", "openapi")
+def rule_openapi(models):
+    try:
+        data = models["openapi"].data
+    except ArtifactError as e:
+        return [f"Cannot parse OpenAPI JSON: {e}"]
+    if validate_spec is not None:
+        try:
+            validate_spec(data)
+            return []
+        except Exception:
+            pass
     issues = []
+    if "openapi" not in data: issues.append("Missing 'openapi' field.")
+    if "paths" not in data: issues.append("Missing 'paths' object.")
+    return issues
+
+@rule("erd_api", "openapi", "erd")
+def rule_erd_api(models):
     try:
-        data = json.load(open(openapi_json_path,"r"))
-        props = set(_openapi_props(data))
-    except Exception as e:
+        props = models["openapi"].properties
+    except ArtifactError as e:
         return [f"OpenAPI parse failed: {e}"]
-
     try:
-        erd_text = open(erd_path,"r",encoding="utf-8").read()
-        fields = set(_parse_erd_fields(erd_text))
-    except Exception as e:
+        fields = models["erd"].fields
+    except ArtifactError as e:
         return [f"ERD parse failed: {e}"]
 
+    issues = []
     must_have = {"lpn","sku","qty","bin"}
     missing = (must_have & props) - fields
     if missing:
@@ -62,20 +128,61 @@ def check_api_vs_erd(openapi_json_path: str, erd_path: str):
         issues.append("No overlap between API properties and ERD fields (check naming).")
     return issues
 
-def check_nfr_vs_deployment(nfr_md_path: str, deployment_mmd_path: str):
+@rule("nfr_deployment", "nfr", "deployment")
+def rule_nfr_deployment(models):
+    try:
+        targets, dep = models["nfr"].targets, models["deployment"]
+    except ArtifactError as e:
+        return [str(e)]
     issues = []
+    target = targets.get("latency_ms")
+    if target is not None and target <= 300:
+        if not dep.has("rabbitmq", "kafka"):
+            issues.append("NFR 300ms target but no message queue in deployment diagram.")
+        if not dep.has("gateway"):
+            issues.append("NFR 300ms target but API Gateway not present in deployment.")
+    return issues
+
+# ---------- entry points ----------
+
+def _check(name: str, **texts):
+    return RULES[name][0](Models({m: parse(m, t) for m,t in texts.items()}))
+
+def validate_openapi(openapi_path: str):
+    try:
+        text = _read(openapi_path)
+    except Exception as e:
+        return [f"Cannot parse OpenAPI JSON: {e}"]
+    return validate_openapi_text(text)
+
+def validate_openapi_text(openapi_text: str):
+    return _check("openapi", openapi=openapi_text)
+
+def check_api_vs_erd(openapi_json_path: str, erd_path: str):
     try:
-        nfr = open(nfr_md_path,"r",encoding="utf-8").read().lower()
-        dep = open(deployment_mmd_path,"r",encoding="utf-8").read().lower()
+        openapi_text = _read(openapi_json_path)
+    except Exception as e:
+        return [f"OpenAPI parse failed: {e}"]
+    try:
+        erd_text = _read(erd_path)
+    except Exception as e:
+        return [f"ERD parse failed: {e}"]
+    return check_api_vs_erd_text(openapi_text, erd_text)
+
+def check_api_vs_erd_text(openapi_text: str, erd_text: str):
+    return _check("erd_api", openapi=openapi_text, erd=erd_text)
+
+def check_nfr_vs_deployment(nfr_md_path: str, deployment_mmd_path: str):
+    try:
+        nfr, dep = _read(nfr_md_path), _read(deployment_mmd_path)
     except Exception as e:
         return [f"Read error: {e}"]
+    return check_nfr_vs_deployment_text(nfr, dep)
 
-    m = re.search(r"latency.*?(\d+)\s*ms", nfr)
-    if m:
-        target = int(m.group(1))
-        if target <= 300:
-            if "rabbitmq" not in dep and "kafka" not in dep:
-                issues.append("NFR 300ms target but no message queue in deployment diagram.")
-            if "api gateway" not in dep and "gateway" not in dep:
-                issues.append("NFR 300ms target but API Gateway not present in deployment.")
-    return issues
+def check_nfr_vs_deployment_text(nfr_text: str, deployment_text: str):
+    return _check("nfr_deployment", nfr=nfr_text, deployment=deployment_text)
+
+def validate_artifacts(module: str, artifacts: dict, rules=None):
+    """Run all registered rules (or just `rules`) on in-memory artifacts ({file name: content}) as rendered by
+    render_artifacts. Each artifact is parsed once; results are cached by artifact content hash."""
+    return run(module, artifacts, rules)
@@ -6,4 +6,6 @@ python -m pip install --upgrade pip setuptools wheel
 pip install requests || true
 pip install openai google-generativeai || true
 pip install openapi-spec-validator || true
+pip install numpy || true
+pip install tiktoken || true
 echo "Done."
@@ -0,0 +1,26 @@
+from orchestrator import context_packer
+from orchestrator.context_packer import Snippet, pack
+
+DOC = "# Receiving\nPallets are received at the dock. ASN lines are matched per LPN.\n# Putaway\nPutaway is directed by zone."
+
+def test_fits_budget_and_drops_near_duplicates():
+    snippets = [Snippet("a.md", DOC, 2.0), Snippet("b.md", DOC + " Extra.", 1.0)]
+    text, stats = pack("ASN receiving dock", snippets, 1000)
+    assert stats["duplicates"] == 1 and stats["snippets_out"] == 1
+    assert "# Receiving" in text and stats["tokens_out"] <= 1000
+
+def test_overshoot_shrinks_with_headings_chosen(monkeypatch):
+    # a tokenizer that counts joined text as more than the sum of its sentences forces the shrink loop
+    real = context_packer.count_tokens
+    monkeypatch.setattr(context_packer, "count_tokens", lambda text, model=None: real(text, model) + 4 * text.count("\n"))
+    context_packer._analyse.cache_clear()
+    try:
+        text, stats = pack("ASN receiving dock putaway", [Snippet("a.md", DOC, 1.0)], 44)
+    finally:
+        context_packer._analyse.cache_clear()
+    assert stats["tokens_out"] <= 44
+    lines = text.splitlines()
+    assert lines[0] == "### a.md (score=1.000)"
+    for n, line in enumerate(lines[1:], 1):
+        if line.startswith("#"):  # a heading is its own line and never left without a sentence under it
+            assert line in ("# Receiving", "# Putaway") and n + 1 < len(lines) and not lines[n + 1].startswith("#")
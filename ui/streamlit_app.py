@@ -1,4 +1,6 @@
-import streamlit as st, requests
+import streamlit as st, requests, time
+
+JOB_MAX_WAIT_S = 600  # thời gian tối đa chờ một job generate trước khi bỏ cuộc
 
 st.set_page_config(page_title="WMS Design AI Agent", layout="wide")
 st.title("WMS Design AI Agent — Enhanced")
@@ -41,9 +43,30 @@ if st.button("Generate Design Pack"):
             "llm_provider": llm_provider,
             "use_rag": use_rag,
         }
-        r = requests.post(f"{api}/generate", json=payload, timeout=180)
+        r = requests.post(f"{api}/jobs/generate", json=payload, timeout=15)
         if r.ok:
-            data = r.json()
+            # Theo dõi tiến độ job thay vì giữ kết nối chờ /generate
+            job_url = f"{api}{r.json()['status_url']}"
+            bar = st.progress(0.0, text="queued")
+            deadline = time.monotonic() + JOB_MAX_WAIT_S
+            while True:
+                jr = requests.get(job_url, timeout=15)
+                if jr.status_code == 404:
+                    # job chỉ giữ trong bộ nhớ: API khởi động lại thì job mất
+                    raise RuntimeError("Job not found (the API may have restarted); please generate again.")
+                if not jr.ok:
+                    raise RuntimeError(f"Job status failed ({jr.status_code}): {jr.text}")
+                job = jr.json()
+                running = [k for k, v in job.get("stages", {}).items() if v.get("status") == "running"]
+                bar.progress(job.get("progress", 0.0), text=running[0] if running else job.get("status", "?"))
+                if job.get("status") in ("done", "error"):
+                    break
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Job still {job.get('status')} after {JOB_MAX_WAIT_S}s; check {job_url}")
+                time.sleep(0.5)
+            if job["status"] == "error":
+                raise RuntimeError(job.get("error") or "Job failed")
+            data = job["result"]
             st.success("Generated!")
 
             # Hiển thị báo cáo validation trước
@@ -67,5 +90,6 @@ if st.button("Generate Design Pack"):
 
 st.caption(
     "Tip: Set env OPENAI_API_KEY hoặc GOOGLE_API_KEY nếu dùng LLM. "
-    "Có thể đặt WMS_OUT_DIR để chỉ định thư mục lưu output (mặc định ./outputs)."
+    "Design pack được giữ trong bộ nhớ và tải qua /download; đặt WMS_PERSIST=1 để lưu ZIP vào "
+    "WMS_OUT_DIR/store (mặc định ./outputs/store)."
 )